@@ -1,19 +1,33 @@
 import json
+import contextvars
 import database
 import datetime
 import time
 import requests
+import http_client
 import os
-from dotenv import load_dotenv
 import traceback
-from analyze_transactions import get_transactions
+import clients
+import context
+import metrics
+import response_cache
+import gemini_request
+from analyze_transactions import get_transactions, get_coin_data, get_swap_store, priced_columns
+from analytics import columns_pnl, SOL_MINT
+from tool_format import encode_trades, encode_price_history, encode_tokens, MAX_ROWS
+from token_registry import find_token
 from analyze_tokens import get_historical_prices
-load_dotenv()
 
 gemini_api_key = os.environ.get('GeminiProKey')
-url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={}".format(gemini_api_key)
+gemini_api_url = os.environ.get('GeminiApiUrl', "https://generativelanguage.googleapis.com")
+model = "gemini-2.0-flash-exp"
+url = "{}/v1beta/models/{}:generateContent?key={}".format(gemini_api_url, model, gemini_api_key)
+stream_url = "{}/v1beta/models/{}:streamGenerateContent?alt=sse&key={}".format(gemini_api_url, model, gemini_api_key)
 headers = {"Content-Type": "application/json",}
 
+MAX_TOOL_ROUNDS = int(os.environ.get("GeminiMaxToolRounds", "4"))  # model round trips that may call tools
+TOOL_WORKERS = int(os.environ.get("ToolWorkers", "4"))
+TOOL_ROUNDS_EXCEEDED = "ugh, that needed way too many lookups 😵 ask me something a bit more specific?"
 
 today = datetime.date.today()
 year = today.year
@@ -64,14 +78,37 @@ function_descriptions = [
                 "required": ["token_address","starting_timestamp","ending_timestamp"],
             }
             },
-] 
-
-class llm:
+        {
+            "name": "get_wallet_pnl",
+            "description": "use this function to get the profit and loss of a wallet: realized and unrealized PnL in SOL, cost basis, hold time and win rate per token. prefer this over get_user_trades when the user asks how they are doing",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "wallet_address": {
+                        "type": "string",
+                        "description": "Wallet address of the user to compute the PnL for",
+                    },
+                },
+                "required": ["wallet_address"],
+            }
+            },
+        {
+            "name": "find_token",
+            "description": "use this function to resolve a token symbol or name the user mentions (like $PYTHIA or winnie) to its mint address before calling get_token_details. returns the best matches",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Token symbol, name or the start of one",
+                    },
+                },
+                "required": ["query"],
+            }
+            },
+]
 
-    def __init__(self):
-        self.responseType = "text"
-        self.function_descriptions = function_descriptions
-        self.instruction = """
+instruction = """
         you are a Japaneese girl named Nanami that been born in the blockchain because of the exploit,
         you can read onchain data, you understand degen narratives, lingo and slang.
         Talk like you are funny, a little unapologetic young japaneese nerd.
@@ -81,9 +118,66 @@ class llm:
         hype the user by talking luxury stuff when they win trades ...
         and just be cool
             """
-    def function_call(self,response,_id):
+
+# Everything but the contents is the same for every chat request, so it is
+# serialized once and reused (or uploaded once as a cachedContents handle)
+template = gemini_request.Template({
+    "system_instruction": {
+        "parts": [
+            {
+                "text": instruction
+            },
+        ],
+        "role": "system"
+    },
+    "tools": [{
+        "functionDeclarations": function_descriptions
+    }],
+    "safetySettings": [
+        {
+            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+            "threshold": "BLOCK_ONLY_HIGH"
+        },
+        {
+            "category": "HARM_CATEGORY_HARASSMENT",
+            "threshold": "BLOCK_ONLY_HIGH"
+        },
+        {
+            "category": "HARM_CATEGORY_HATE_SPEECH",
+            "threshold": "BLOCK_ONLY_HIGH"
+        },
+        {
+            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            "threshold": "BLOCK_ONLY_HIGH"
+        },
+    ],
+    "generationConfig": {
+        "temperature": 0.1,
+        "topK": 1,
+        "topP": 1,
+        "maxOutputTokens": 2048,
+        "stopSequences": [],
+        #'safety_settings': [{"category":"HARM_CATEGORY_DEROGATORY","threshold":4},{"category":"HARM_CATEGORY_TOXICITY","threshold":4},{"category":"HARM_CATEGORY_VIOLENCE","threshold":4},{"category":"HARM_CATEGORY_SEXUAL","threshold":4},{"category":"HARM_CATEGORY_MEDICAL","threshold":4},{"category":"HARM_CATEGORY_DANGEROUS","threshold":4}]
+    },
+}, model, gemini_api_url, gemini_api_key)
+
+
+class llm:
+
+    def __init__(self):
+        self.responseType = "text"
+        self.function_descriptions = function_descriptions
+        self.instruction = instruction
+
+    def function_call(self,function_call,_id):
+        metrics.TOOL_CALLS.inc(tool=function_call["name"])
+        with metrics.span(f"tool.{function_call['name']}"):
+            result = self.call_tool(function_call,_id)
+        metrics.PAYLOAD_BYTES.observe(len(str(result.get("function_response", ""))), kind="tool_response")
+        return result
+
+    def call_tool(self,function_call,_id):
         
-        function_call = response["candidates"][0]["content"]["parts"][0]["functionCall"]
         function_name = function_call["name"]
         function_args = function_call["args"]
         print(type(function_args))
@@ -94,12 +188,27 @@ class llm:
             
             if wallet_address:
 
-                trade_transactions = get_transactions(wallet_address)
+                trade_transactions = encode_trades(get_transactions(wallet_address))
                 print(trade_transactions)
-                return {"function_response":str(trade_transactions),"image":None}
+                return {"function_response":trade_transactions,"image":None}
                 
             else:
                 return {"function_response":"wallet_address required","image":None}
+        if function_name == "get_wallet_pnl":
+            wallet_address = function_args.get("wallet_address")
+            if not wallet_address:
+                return {"function_response":"wallet_address required","image":None}
+
+            sol = get_coin_data(SOL_MINT)
+            store = get_swap_store(wallet_address)
+            pnl = columns_pnl(priced_columns(store), store.swap_count, sol_price=sol['current_price'] if sol else None)
+            print(pnl)
+            return {"function_response":str(pnl),"image":None}
+        if function_name == "find_token":
+            query = function_args.get("query")
+            if not query:
+                return {"function_response":"query required","image":None}
+            return {"function_response":encode_tokens(find_token(query)),"image":None}
         if function_name == "get_token_details":
             starting_timestamp = function_args.get("starting_timestamp")
             ending_timestamp = function_args.get("ending_timestamp")
@@ -109,9 +218,9 @@ class llm:
             if ending_timestamp == "now":
                 ending_timestamp = int(datetime.datetime.now().timestamp())
                 
-            price_hisotry = get_historical_prices(address=token_address,address_type="token",time_from=int(starting_timestamp),time_to=int(ending_timestamp))
+            price_hisotry = get_historical_prices(address=token_address,address_type="token",time_from=int(starting_timestamp),time_to=int(ending_timestamp),target_points=MAX_ROWS)
             if price_hisotry:
-                return {"function_response":f"here is the price history of the token\n{price_hisotry}","image":None}
+                return {"function_response":f"here is the price history of the token\n{encode_price_history(price_hisotry)}","image":None}
             
             return {"function_response":'could not find the token Detail'}
 
@@ -121,142 +230,228 @@ class llm:
             return {"function_response":'function not found!'}
 
 
-    def generate_response(self,_id,messages):
-        data = {
-                "contents": messages,
-                "system_instruction": {
-                      "parts": [
-                        {
-                          "text": self.instruction
-                        }, 
-                      ],
-                      "role": "system" 
-                    },
-                "tools": [{
-                    "functionDeclarations": function_descriptions
-                    }],
-                "safetySettings": [
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-        ],
-                "generationConfig": {
-                "temperature": 0.1,
-                "topK": 1,
-                "topP": 1,
-                "maxOutputTokens": 2048,
-                "stopSequences": [],
-                #'safety_settings': [{"category":"HARM_CATEGORY_DEROGATORY","threshold":4},{"category":"HARM_CATEGORY_TOXICITY","threshold":4},{"category":"HARM_CATEGORY_VIOLENCE","threshold":4},{"category":"HARM_CATEGORY_SEXUAL","threshold":4},{"category":"HARM_CATEGORY_MEDICAL","threshold":4},{"category":"HARM_CATEGORY_DANGEROUS","threshold":4}]
-              },}
+    def post_model(self,endpoint,data,**kwargs):
+        """POST a request body to Gemini, serialized from its template when it has one
 
+        If Gemini rejects the cachedContents handle the request referenced,
+        the handle is dropped and the request is sent again with the static
+        prefix inline.
+        """
+        if not isinstance(data, gemini_request.Request):
+            body = json.dumps(data)
+            metrics.PAYLOAD_BYTES.observe(len(body), kind="gemini_request")
+            return http_client.post(endpoint, headers=headers, data=body, **kwargs)
+
+        body, handle = data.template.serialize(data)
+        metrics.PAYLOAD_BYTES.observe(len(body), kind="gemini_request")
+        response = http_client.post(endpoint, headers=headers, data=body, **kwargs)
+        if handle and response.status_code in (400, 403, 404):
+            print(f"Gemini rejected context cache {handle}: {response.status_code} - {response.text}")
+            response.close()
+            data.template.invalidate(handle)
+            body, _ = data.template.serialize(data, use_cache=False)
+            response = http_client.post(endpoint, headers=headers, data=body, **kwargs)
+        return response
+
+    def request_model(self,data,messages=None,_id=None):
+        """POST a request to Gemini, retrying empty answers
+
+        Transport errors and 429/5xx are already retried with backoff by
+        http_client, so any other failure is raised straight away. Answers are
+        cached per request (scoped to _id unless the cache is global).
+        """
+        cache_key = response_cache.request_key(data, _id)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print("Cached response reused")
+            return cached
 
-        print("generating answer ... ")
-        retries = 0
         max_retries = 3
-        while retries < max_retries:
+        for attempt in range(max_retries):
+            print("Executing request...")
             try:
-                print("Executing request...")
-                response = requests.post(url, headers=headers, json=data)
-                print(f"Status Code: {response.status_code}, Response Body: {response.text}")
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    if response_data:
-                        print("Valid response received:", response_data)
-                        break
-                    else:
-                        print("Empty JSON response received, retrying...")
-                else:
-                    print(f"Received non-200 status code: {response.status_code}")
-                
-                time.sleep(5)
+                with metrics.span("gemini.request"):
+                    response = self.post_model(url, data)
             except requests.exceptions.RequestException as e:
-                print(f'Request failed: {e}, retrying...')
-                time.sleep(5)
-            retries += 1
-        
-        if retries >= max_retries:
-            raise Exception("Failed to get response from the model")
-        while "functionCall" in response_data["candidates"][0]["content"]["parts"][0]:
-            
-            function_call = response_data["candidates"][0]["content"]["parts"][0]["functionCall"]
-            function_name = function_call["name"]
+                raise Exception(f"Failed to get response from the model: {e}")
+            print(f"Status Code: {response.status_code}, Response Body: {response.text}")
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to get response from the model: {response.status_code}")
+
+            response_data = response.json()
+            if response_data:
+                print("Valid response received:", response_data)
+                response_cache.put(cache_key, data, response_data)
+                return response_data
+
+            print("Empty JSON response received, retrying...")
+            metrics.GEMINI_RETRIES.inc()
+            if messages is not None:
+                ask_response = {"role": "user",
+                                "parts": [{"text": "??"}]
+                                }
+                if messages[-1] != ask_response:
+                    messages.append(ask_response)
+                    print(messages[-1])
+            time.sleep(http_client.backoff_delay(attempt))
+
+        raise Exception("Failed to get response from the model")
 
-            function_response = self.function_call(response_data,_id)
+    def summarize(self,previous,transcript):
+        """Fold a transcript of older turns into the rolling conversation summary"""
+        prompt = ("Update this summary of a chat between a user and Nanami, a crypto trading assistant, "
+                  "with the new turns below. Keep wallet addresses, tokens, trades and numbers that "
+                  "matter for later questions. Reply with the summary only, under 150 words.\n\n"
+                  f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}")
+        data = {
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 512},
+                }
+        response_data = self.request_model(data)
+        return response_data["candidates"][0]["content"]["parts"][0]["text"].strip()
+
+    def build_request(self,contents):
+        return template.build(contents)
+
+    def run_function_calls(self,_id,function_calls,contents,text_parts=()):
+        """Run the tools the model asked for in one turn, store the exchange and extend contents
+
+        Several calls run concurrently on the tool pool; their responses go
+        back in call order as one function message, written to Mongo once.
+        """
+        if len(function_calls) == 1:
+            function_responses = [self.function_call(function_calls[0],_id)]
+        else:
+            pool = clients.pool("tool", TOOL_WORKERS)
+            futures = [pool.submit(contextvars.copy_context().run, self.function_call, function_call, _id)
+                       for function_call in function_calls]
+            function_responses = [future.result() for future in futures]
+
+        function = list(text_parts) + [{
+                    "functionCall": {
+                    "name": function_call["name"],
+                    "args": function_call["args"]
+                                    }             
+                        } for function_call in function_calls]
+        functionResponse = []
+        for function_call, function_response in zip(function_calls, function_responses):
             function_response_message = function_response["function_response"]
             print(function_response_message)
-            #bot.send_chat_action(tg.chat.id, 'typing')
-
-            result = json.dumps(function_response)
-            function = [{
-                        "functionCall": {
-                        "name": function_name,
-                        "args": function_call["args"]
-                                        }             
-                            }]
-            functionResponse = [{
-                                "functionResponse":{
-                                    "name": function_name,
-                                    "response":{
-                                        "name": function_name,
-                                        "content": function_response_message
-                                                }
-                                                    }  
-                                    },
-                                    
-                                    ]
-            database.add_message(_id,function,"model")
-            database.add_message(_id,functionResponse,"function")   
-            messages.append({
-                            "role": "model",
-                            "parts": function
-                            },)
-            messages.append({"role": "function",
-                            "parts": functionResponse
-                                }) 
-            retries = 0
-            max_retries = 3
-            while retries < max_retries:
-                try:
-                    print("Executing request...")
-                    response = requests.post(url, headers=headers, json=data)
-                    print(f"Status Code: {response.status_code}, Response Body: {response.text}")
-                    
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        if response_data:
-                            print("Valid response received:", response_data)
-                            break
-                        else:
-                            print("Empty JSON response received, retrying...")
-                            ask_response = {"role": "user",
-                                            "parts": [{"text": "??"}]
+            functionResponse.append({
+                            "functionResponse":{
+                                "name": function_call["name"],
+                                "response":{
+                                    "name": function_call["name"],
+                                    "content": function_response_message
                                             }
-                            if messages[-1] != ask_response:
-                                messages.append(ask_response)
-                                print(messages[-1])
-                    else:
-                        print(f"Received non-200 status code: {response.status_code}")
-                    
-                    retries += 1
-                    time.sleep(5)
-                except requests.exceptions.RequestException as e:
-                    print(f'Request failed: {e}, retrying...')
-                    retries += 1
-                    time.sleep(5)
-            
+                                                }  
+                                })
+        database.add_messages(_id,[
+                        {"role": "model", "parts": function},
+                        {"role": "function", "parts": functionResponse},
+                        ])
+        contents.append({
+                        "role": "model",
+                        "parts": function
+                        },)
+        contents.append({"role": "function",
+                        "parts": functionResponse
+                            }) 
+
+    @metrics.traced("generate_response")
+    def generate_response(self,_id,messages):
+        contents = context.build_contents(_id, messages, self.summarize)
+        data = self.build_request(contents)
+
+        print("generating answer ... ")
+        response_data = self.request_model(data, _id=_id)
+        for _ in range(MAX_TOOL_ROUNDS):
+            parts = response_data["candidates"][0]["content"]["parts"]
+            function_calls = [part["functionCall"] for part in parts if "functionCall" in part]
+            if not function_calls:
+                break
+            text_parts = [{"text": part["text"]} for part in parts if part.get("text")]
+            self.run_function_calls(_id, function_calls, contents, text_parts)
+            response_data = self.request_model(data, contents, _id=_id)
+        else:
+            print(f"Stopped after {MAX_TOOL_ROUNDS} tool rounds")
+
+        text = "".join(part.get("text", "") for part in response_data["candidates"][0]["content"]["parts"])
+        return text or TOOL_ROUNDS_EXCEEDED
+
+    def stream_model(self,data,_id=None):
+        """POST a request to streamGenerateContent and yield each SSE chunk as JSON
+
+        A cached answer is yielded as a single chunk. A fully consumed stream
+        is stored as one combined response.
+        """
+        cache_key = response_cache.request_key(data, _id)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print("Cached response reused")
+            yield cached
+            return
+
+        response = self.post_model(stream_url, data, stream=True)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get response from the model: {response.status_code} - {response.text}")
+        text = []
+        parts = []
+        usage = {}
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    chunk = json.loads(line[len("data:"):])
+                    for part in (chunk.get("candidates") or [{}])[0].get("content", {}).get("parts", []):
+                        if "text" in part:
+                            text.append(part["text"])
+                        else:
+                            parts.append(part)
+                    usage = chunk.get("usageMetadata", usage)
+                    yield chunk
+        finally:
+            response.close()
+
+        parts = ([{"text": "".join(text)}] if text else []) + parts
+        response_cache.put(cache_key, data, {
+            "candidates": [{"content": {"role": "model", "parts": parts}}],
+            "usageMetadata": usage,
+        })
+
+    @metrics.traced("stream_response")
+    def stream_response(self,_id,messages):
+        """Like generate_response but yields the answer text as it arrives
+
+        Function calls in the stream are run as soon as the model turn ends,
+        then streaming resumes with the tool results in context.
+        """
+        contents = context.build_contents(_id, messages, self.summarize)
+        data = self.build_request(contents)
+
+        print("streaming answer ... ")
+        answered = False
+        for round_trip in range(MAX_TOOL_ROUNDS + 1):
+            text_parts = []
+            function_calls = []
+            for chunk in self.stream_model(data, _id):
+                candidates = chunk.get("candidates") or [{}]
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    if "functionCall" in part:
+                        function_calls.append(part["functionCall"])
+                    elif part.get("text"):
+                        text_parts.append({"text": part["text"]})
+                        answered = True
+                        yield part["text"]
+
+            if not function_calls:
+                return
+            if round_trip == MAX_TOOL_ROUNDS:
+                break
+            # Keep any text streamed before the calls in the stored model turn
+            text = "".join(part["text"] for part in text_parts)
+            self.run_function_calls(_id, function_calls, contents, [{"text": text}] if text else [])
 
-        return response_data["candidates"][0]["content"]["parts"][0]["text"]
+        print(f"Stopped after {MAX_TOOL_ROUNDS} tool rounds")
+        if not answered:
+            yield TOOL_ROUNDS_EXCEEDED
@@ -0,0 +1,174 @@
+import time
+import numpy as np
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+
+
+def swap_arrays(swaps):
+    """Columnar view of analyze_swap_transactions output
+
+    One row per non-SOL token leg, `swap` is the position of its swap.
+    `amount` is signed (+ bought, - sold) and `sol` is the SOL that moved
+    against it (- spent, + received), split evenly when one swap moves
+    several tokens against SOL. Rows with no SOL leg
+    (token-to-token swaps) have sol = NaN.
+    """
+    mints = {}
+    names = []
+    timestamps, swap_ids, mint_ids, amounts, sols = [], [], [], [], []
+
+    for index, swap in enumerate(swaps):
+        sold = swap.get('sold_tokens', [])
+        bought = swap.get('bought_tokens', [])
+        # Native and wrapped SOL can both show up for the same leg, count it once
+        sol_in = max((t['amount'] for t in sold if t['address'] == SOL_MINT), default=0.0)
+        sol_out = max((t['amount'] for t in bought if t['address'] == SOL_MINT), default=0.0)
+        legs = [(t, 1.0) for t in bought if t['address'] != SOL_MINT] + \
+               [(t, -1.0) for t in sold if t['address'] != SOL_MINT]
+        if not legs:
+            continue
+        n_buys = sum(1 for _, sign in legs if sign > 0)
+        n_sells = len(legs) - n_buys
+
+        for token, sign in legs:
+            mint = token['address']
+            if mint not in mints:
+                mints[mint] = len(names)
+                names.append(token)
+            if sign > 0:
+                sol = -sol_in / n_buys if sol_in else np.nan
+            else:
+                sol = sol_out / n_sells if sol_out else np.nan
+            timestamps.append(swap['timestamp'])
+            swap_ids.append(index)
+            mint_ids.append(mints[mint])
+            amounts.append(sign * token['amount'])
+            sols.append(sol)
+
+    return {
+        'timestamp': np.asarray(timestamps, dtype=np.int64),
+        'swap': np.asarray(swap_ids, dtype=np.int32),
+        'mint': np.asarray(mint_ids, dtype=np.int32),
+        'amount': np.asarray(amounts, dtype=np.float64),
+        'sol': np.asarray(sols, dtype=np.float64),
+        'tokens': names,
+    }
+
+
+def position_stats(columns, sol_price=None, now=None):
+    """Per-token cost basis, PnL and hold time from swap columns, in vectorized passes
+
+    Cost basis is the average SOL paid per token over all buys with a SOL
+    leg. Realized PnL compares the average SOL received per token sold
+    against that basis for the amount sold, capped at the amount bought in
+    the window; sells beyond that (airdrops, buys older than the synced
+    history) are reported as `unmatched_sold` and left out. Unrealized PnL
+    values the remaining position at the token's current USD price
+    converted with `sol_price`. All PnL figures are in SOL.
+    """
+    now = now or int(time.time())
+    tokens = columns['tokens']
+    n = len(tokens)
+    mint, amount, sol, ts = columns['mint'], columns['amount'], columns['sol'], columns['timestamp']
+
+    buy = amount > 0
+    sell = ~buy
+    priced = ~np.isnan(sol)
+    priced_buy = buy & priced
+    priced_sell = sell & priced
+
+    bought = np.bincount(mint[buy], weights=amount[buy], minlength=n)
+    sold = np.bincount(mint[sell], weights=-amount[sell], minlength=n)
+    priced_qty = np.bincount(mint[priced_buy], weights=amount[priced_buy], minlength=n)
+    cost = np.bincount(mint[priced_buy], weights=-sol[priced_buy], minlength=n)
+    priced_sold = np.bincount(mint[priced_sell], weights=-amount[priced_sell], minlength=n)
+    proceeds = np.bincount(mint[priced_sell], weights=sol[priced_sell], minlength=n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_cost = np.where(priced_qty > 0, cost / priced_qty, np.nan)
+        avg_proceeds = np.where(priced_sold > 0, proceeds / priced_sold, np.nan)
+    matched = np.minimum(sold, bought)
+    realized = np.where(matched > 0, (avg_proceeds - avg_cost) * matched, 0.0)
+    position = np.maximum(bought - sold, 0.0)
+    # Treat dust left after a full exit as closed
+    position = np.where(position <= bought * 1e-6, 0.0, position)
+
+    price_usd = np.array([t.get('current_price') or np.nan for t in tokens], dtype=np.float64)
+    price_sol = price_usd / sol_price if sol_price else np.full(n, np.nan)
+    unrealized = np.where(position > 0, position * (price_sol - avg_cost), 0.0)
+
+    first_buy = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(first_buy, mint[buy], ts[buy])
+    last_sell = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last_sell, mint[sell], ts[sell])
+    held_until = np.where(position > 0, now, last_sell)
+    held_from = np.where(bought > 0, first_buy, held_until)
+    hold_seconds = np.maximum(held_until - held_from, 0)
+
+    # Only fully exited positions count as closed (and towards the win rate)
+    closed = (matched > 0) & (position == 0) & ~np.isnan(realized)
+    wins = closed & (realized > 0)
+
+    return {
+        'tokens': tokens,
+        'bought': bought,
+        'sold': sold,
+        'unmatched_sold': sold - matched,
+        'avg_cost_sol': avg_cost,
+        'realized_sol': realized,
+        'position': position,
+        'unrealized_sol': unrealized,
+        'hold_seconds': hold_seconds,
+        'closed': closed,
+        'wins': wins,
+    }
+
+
+def _round(value, digits=4):
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+
+def wallet_pnl(swaps, sol_price=None, now=None):
+    """Small, model-friendly PnL summary for a wallet's swap history"""
+    return columns_pnl(swap_arrays(swaps), len(swaps), sol_price=sol_price, now=now)
+
+
+def columns_pnl(columns, swap_count, sol_price=None, now=None):
+    """wallet_pnl for swap columns, e.g. a slice of the wallet's swap_store"""
+    if not len(columns['mint']):
+        return {'swaps': swap_count, 'tokens': []}
+
+    stats = position_stats(columns, sol_price=sol_price, now=now)
+    realized = np.nan_to_num(stats['realized_sol'])
+    unrealized = np.nan_to_num(stats['unrealized_sol'])
+    closed = int(stats['closed'].sum())
+
+    tokens = []
+    for i in np.argsort(-(realized + unrealized)):
+        if not (stats['bought'][i] or stats['sold'][i]):
+            continue  # not traded in this slice
+        token = stats['tokens'][i]
+        tokens.append({
+            'symbol': token.get('symbol'),
+            'address': token['address'],
+            'avg_cost_sol': _round(stats['avg_cost_sol'][i], 10),
+            'realized_pnl_sol': _round(stats['realized_sol'][i]),
+            'unrealized_pnl_sol': _round(stats['unrealized_sol'][i]),
+            'position': _round(stats['position'][i], 2),
+            'hold_hours': _round(stats['hold_seconds'][i] / 3600, 1),
+        })
+        if stats['unmatched_sold'][i] > 0:
+            tokens[-1]['unmatched_sold'] = _round(stats['unmatched_sold'][i], 2)
+
+    return {
+        'swaps': swap_count,
+        'tokens_traded': len(tokens),
+        'realized_pnl_sol': _round(realized.sum()),
+        'unrealized_pnl_sol': _round(unrealized.sum()),
+        'win_rate': _round(stats['wins'].sum() / closed, 3) if closed else None,
+        'closed_positions': closed,
+        'open_positions': int((stats['position'] > 0).sum()),
+        'sol_price_usd': sol_price,
+        'tokens': tokens,
+    }
@@ -1,12 +1,24 @@
-import requests
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 import json
+import time
+import clients  # loads .env when run as a script
+from cache import get_cache
+import candle_store
+import price_series
+import http_client
+import metrics
+import singleflight
 
-load_dotenv(override=True)
 api_key = os.environ.get("BirdEyeApi")
 
+BIRDEYE_API_URL = os.environ.get("BirdEyeApiUrl", 'https://public-api.birdeye.so')
+
+# Settled candles never change, so stores live until LRU eviction
+price_cache = get_cache("price_history", ttl=30 * 24 * 60 * 60, max_entries=20000)
+PRICE_MAX_STALE = 60 * 60  # how old an open-candle tail may be when served during a refresh
+
+@metrics.traced("get_historical_prices")
 def get_historical_prices(
     address: str,
     time_from: int,
@@ -15,10 +27,16 @@ def get_historical_prices(
     interval_type: str = "12H",
     chain: str = 'solana',
     currency: str = 'USD',
-    cache_file: str = 'token_price_history.json'
-) -> list:
+    target_points: int = None,
+    resample: str = 'lttb'
+) -> dict:
     """
     Fetch historical token prices from BirdEye API
+
+    Prices are kept in a per-token candle store, so only the parts of the
+    range that were never fetched before hit the API. Concurrent fetches of
+    one store are coalesced, and an expired open tail is served while it
+    refreshes in the background.
     Args:
         address: Token contract address
         address_type: Type of address (typically 'token')
@@ -27,41 +45,106 @@ def get_historical_prices(
         time_to: End timestamp (Unix seconds)
         api_key: BirdEye API key
         chain: Blockchain network (default: 'solana')
-        currency: Currency symbol to append to price (default: 'USD')
-        cache_file: Path to cache file (default: 'token_price_history.json')
+        currency: Quote currency of the prices (default: 'USD')
+        target_points: Downsample to at most this many points (default: keep all)
+        resample: 'lttb' to keep the most significant points, 'ohlc' for
+            equal-count OHLC bars with the close as the series value
     
     Returns:
-        List of formatted price entries with datetime and price
+        Dict with numeric 'timestamps' and 'prices' lists, the number of raw
+        'points', and 'stats' (first, last, min, max, change_pct,
+        volatility_pct) computed over the full range; False if no prices
     """
-    # Generate unique cache key
-    cache_key = f"{address}-{address_type}-{interval_type}-{time_from}-{time_to}-{chain}-{currency}"
-    
-    # Load cache
-    cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                cache = json.load(f)
-        except json.JSONDecodeError:
-            pass
-
-    # Cache check logic
-    if cache_key in cache:
-        cache_entry = cache[cache_key]
-        cache_age = datetime.now() - datetime.fromisoformat(cache_entry['fetch_time'])
-        
-        if cache_age <= timedelta(hours=3):
-            # Return False if cached items are empty
-            if not cache_entry['items']:
-                return False
-            return {
-                'token': address,
-                'fetch_time': cache_entry['fetch_time'],
-                'history': cache_entry['items']
-            }
-
-    # API call when no valid cache exists
-    url = 'https://public-api.birdeye.so/defi/history_price'
+    # One candle store per token and interval, shared by all requested ranges
+    cache_key = f"{address}-{address_type}-{interval_type}-{chain}"
+    now = time.time()
+    time_to = min(time_to, int(now))
+
+    filled = []
+
+    def fill():
+        filled.append(True)
+        return fill_gaps(cache_key, address, address_type, interval_type, chain, time_from, time_to)
+
+    def gaps_in(store, tail_ttl=candle_store.TAIL_TTL):
+        return candle_store.missing_ranges(candle_store.covered_ranges(store, now, tail_ttl), time_from, time_to)
+
+    def recheck():
+        # Another worker may have filled the range meanwhile
+        current = price_cache.get_entry(cache_key, shared=True)
+        return current.value if current and not gaps_in(current.value) else None
+
+    entry = price_cache.get_entry(cache_key)
+    store = entry.value if entry else candle_store.empty()
+    gaps = gaps_in(store)
+    metrics.cache_result("price_history", not gaps)
+
+    if gaps and not gaps_in(store, tail_ttl=PRICE_MAX_STALE):
+        # Only the expired open candles are missing: answer with them and refresh
+        singleflight.refresh(price_cache, cache_key, fill)
+    elif gaps:
+        store = singleflight.do(price_cache, cache_key, fill, recheck=recheck)
+        if not filled and gaps_in(store):
+            # We joined a fetch for a different range, fill ours as well
+            store = singleflight.do(price_cache, cache_key, fill, recheck=recheck)
+
+    timestamps, values = candle_store.window(store, time_from, time_to)
+
+    # Return False if there are no prices in range
+    if not timestamps:
+        return False
+
+    history = {
+        'token': address,
+        'fetch_time': datetime.now().isoformat(),
+        'currency': currency,
+        'interval': interval_type,
+        'points': len(timestamps),
+        'stats': price_series.stats(values),
+    }
+
+    # Reduce long ranges to target_points before they reach any consumer
+    if target_points and len(timestamps) > target_points:
+        if resample == 'ohlc':
+            bars = price_series.ohlc(timestamps, values, target_points)
+            history['ohlc'] = {key: column.tolist() for key, column in bars.items() if key != 'timestamps'}
+            timestamps, values = bars['timestamps'], bars['close']
+        else:
+            timestamps, values = price_series.lttb(timestamps, values, target_points)
+        timestamps, values = [int(ts) for ts in timestamps], [float(value) for value in values]
+
+    history['timestamps'] = list(timestamps)
+    history['prices'] = list(values)
+    return history
+
+
+def fill_gaps(cache_key, address, address_type, interval_type, chain, time_from, time_to):
+    """Fetch the parts of [time_from, time_to] missing from a candle store; returns the merged store"""
+    interval = candle_store.interval_seconds(interval_type)
+    now = time.time()
+    entry = price_cache.get_entry(cache_key, shared=True)
+    store = entry.value if entry else candle_store.empty()
+    gaps = candle_store.missing_ranges(candle_store.covered_ranges(store, now), time_from, time_to)
+
+    fetched = candle_store.empty()
+    for gap_from, gap_to in gaps:
+        print(f"Fetching {interval_type} prices for {address} {gap_from}..{gap_to}")
+        items = fetch_price_history(address, address_type, interval_type, gap_from, gap_to, chain)
+        if items is None:
+            # Unsuccessful request, don't record the range as known-empty
+            continue
+        candle_store.record_fetch(fetched, gap_from, gap_to,
+                                  [item['unixTime'] for item in items],
+                                  [item['value'] for item in items],
+                                  interval, now)
+    return price_cache.update(
+        cache_key, lambda current: candle_store.merge_stores(current or candle_store.empty(), fetched))
+
+
+@metrics.traced("birdeye.history_price")
+def fetch_price_history(address, address_type, interval_type, time_from, time_to, chain='solana'):
+    """One BirdEye history_price call; returns its items, or None if unsuccessful"""
+    url = BIRDEYE_API_URL + '/defi/history_price'
     params = {
         'address': address,
         'address_type': address_type,
@@ -75,45 +158,14 @@ def get_historical_prices(
         'X-API-KEY': api_key
     }
 
-    response = requests.get(url, params=params, headers=headers)
+    response = http_client.get(url, params=params, headers=headers)
     if response.status_code != 200:
         raise Exception(f'API request failed: {response.status_code} - {response.text}')
 
     data = response.json()
-    # Return False for unsuccessful requests or missing items
-    if not data.get('success') or not data.get('data', {}).get('items'):
-        return False
-
-    # Process results
-    fetch_time = datetime.now().isoformat()
-    formatted = []
-    for item in data['data']['items']:
-        dt = datetime.fromtimestamp(item['unixTime'])
-        formatted.append({
-            'time': dt.strftime('%Y-%m-%d %H:%M:%S'),
-            'timestamp': item['unixTime'],
-            'price': f"{item['value']:.4f} {currency}"
-        })
-
-    # Return False if no formatted results
-    if not formatted:
-        return False
-
-    # Update cache
-    cache[cache_key] = {
-        'fetch_time': fetch_time,
-        'items': formatted
-    }
-    
-    with open(cache_file, 'w') as f:
-        json.dump(cache, f, indent=2)
-
-    # Return final response
-    return {
-        'token': address,
-        'fetch_time': fetch_time,
-        'history': formatted
-    }
+    if not data.get('success'):
+        return None
+    return (data.get('data') or {}).get('items') or []
 
 
 if __name__ == "__main__":
@@ -123,7 +175,7 @@ if __name__ == "__main__":
     time_from=1737772532,
     time_to=1738647000,
     interval_type='12H',
-    api_key=api_key)
+    target_points=10)
 
     print(json.dumps(prices, indent=2))
     print("updated")
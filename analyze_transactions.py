@@ -1,11 +1,18 @@
 from datetime import datetime, timezone, timedelta
 from io import StringIO
 import json
+import numpy as np
 import requests
 import os
-from dotenv import load_dotenv
-
-load_dotenv(override=True)
+import threading
+import time
+import clients  # loads .env when run as a script
+from cache import get_cache
+import http_client
+import metrics
+import singleflight
+import swap_store
+import token_registry
 
 
 def get_time_ago(timestamp):
@@ -32,30 +39,76 @@ def get_time_ago(timestamp):
     
     return "just now"
 
-def get_coin_data(contract_address, asset_platform_id='solana', cache_file='coin_data_cache.json'):
-    """Retrieve coin data with caching using Helius API"""
+HELIUS_RPC_URL = os.environ.get("HeliusRpcUrl", "https://mainnet.helius-rpc.com/")
+HELIUS_API_URL = os.environ.get("HeliusApiUrl", "https://api.helius.xyz")
+ASSET_BATCH_SIZE = 1000  # getAssetBatch accepts at most 1000 ids per call
+
+COIN_TTL = 60 * 60
+COIN_MAX_STALE = 24 * 60 * 60  # how long past expiry coin data is still served while refreshing
+coin_cache = get_cache("coin_data", ttl=COIN_TTL, max_entries=50000)
+# Sync state is kept long after it goes stale so refreshes can resume from it
+transactions_cache = get_cache("transactions", ttl=30 * 24 * 60 * 60, max_entries=5000)
+TRANSACTIONS_TTL = timedelta(hours=1)
+TRANSACTIONS_MAX_STALE = timedelta(hours=6)  # served while a background sync runs
+SYNC_LOCK_TTL = 5 * 60  # a full 50-page walk can take minutes
+PAGE_SIZE = 100  # Helius maximum for the transactions endpoint
+MAX_PAGES = int(os.environ.get("HeliusMaxPages", "50"))
+
+# Cache keys being resolved by a running get_coin_data_batch call -> its Flight
+_pending_assets = {}
+_pending_assets_lock = threading.Lock()
+DUMP_RAW = os.environ.get("DumpRawTransactions", "0") == "1"  # write each raw Helius batch to test.json
+
+
+def parse_asset(asset):
+    """Extract the coin fields we keep from a Helius DAS asset"""
+    asset = asset or {}
+    token_info = asset.get('token_info', {})
+    price_info = token_info.get('price_info', {})
+
+    return {
+        'name': asset.get('content', {}).get('metadata', {}).get('name', 'Unknown'),
+        'symbol': token_info.get('symbol', '').upper(),
+        'current_price': price_info.get('price_per_token'),
+        'web_slug': None,  # Not available in Helius response
+        'asset_platform_id': 'solana'  # Hardcoded since we're using Solana
+    }
+
+@metrics.traced("get_coin_data")
+def get_coin_data(contract_address, asset_platform_id='solana'):
+    """Retrieve coin data with caching using Helius API
+
+    Concurrent misses for the same token share one Helius call. Expired data
+    up to COIN_MAX_STALE old is returned at once while it refreshes in the
+    background.
+    """
+    cache_key = f"{asset_platform_id}-{contract_address}"
+
+    # Check cache validity (60 minutes)
+    entry = coin_cache.get_entry(cache_key)
+    now = time.time()
+    fresh = entry is not None and (entry.expires_at is None or entry.expires_at > now)
+    metrics.cache_result("coin_data", fresh)
+    if fresh:
+        token_registry.remember(contract_address, entry.value)
+        return entry.value
+
+    def fetch():
+        return fetch_coin_data(contract_address, asset_platform_id)
+
+    if entry is not None and now - entry.stored_at <= COIN_TTL + COIN_MAX_STALE:
+        singleflight.refresh(coin_cache, cache_key, fetch)
+        return entry.value
+
+    return singleflight.do(coin_cache, cache_key, fetch, recheck=lambda: coin_cache.get(cache_key))
+
+def fetch_coin_data(contract_address, asset_platform_id='solana'):
+    """Fetch one token from Helius getAsset and cache it"""
     api_key = os.environ.get("HeliusApi")
     cache_key = f"{asset_platform_id}-{contract_address}"
-    
-    # Load coin cache
-    coin_cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                coin_cache = json.load(f)
-        except json.JSONDecodeError:
-            pass
-
-    # Check cache validity (60 seconds as per API docs)
-    if cache_key in coin_cache:
-        cache_entry = coin_cache[cache_key]
-        cache_age = datetime.now() - datetime.fromisoformat(cache_entry['fetch_time'])
-        
-        if cache_age <= timedelta(minutes=60):
-            return cache_entry['data']
 
     # Helius API call for fresh data
-    url = "https://mainnet.helius-rpc.com/?api-key=" + api_key
+    url = HELIUS_RPC_URL + "?api-key=" + api_key
     headers = {"Content-Type": "application/json"}
     payload = {
         "jsonrpc": "2.0",
@@ -67,34 +120,24 @@ def get_coin_data(contract_address, asset_platform_id='solana', cache_file='coin
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = http_client.post(url, headers=headers, json=payload)
         if response.status_code == 404:
             print(f"Token not found: {contract_address}")
             return None
             
         response.raise_for_status()
         data = response.json()
+        if data.get('error') or not data.get('result'):
+            # Not an asset (e.g. a wallet); Helius says so with a 200
+            print(f"Token not found: {contract_address} {data.get('error')}")
+            return None
         
         # Extract relevant fields from Helius response
-        token_info = data.get('result', {}).get('token_info', {})
-        price_info = token_info.get('price_info', {})
-        
-        coin_data = {
-            'name': data.get('result', {}).get('content', {}).get('metadata', {}).get('name', 'Unknown'),
-            'symbol': token_info.get('symbol', '').upper(),
-            'current_price': price_info.get('price_per_token'),
-            'web_slug': None,  # Not available in Helius response
-            'asset_platform_id': 'solana'  # Hardcoded since we're using Solana
-        }
+        coin_data = parse_asset(data['result'])
         
         # Update cache
-        coin_cache[cache_key] = {
-            'fetch_time': datetime.now().isoformat(),
-            'data': coin_data
-        }
-        
-        with open(cache_file, 'w') as f:
-            json.dump(coin_cache, f, indent=2)
+        coin_cache.set(cache_key, coin_data)
+        token_registry.remember(contract_address, coin_data)
             
         return coin_data
         
@@ -102,12 +145,128 @@ def get_coin_data(contract_address, asset_platform_id='solana', cache_file='coin
         print(f"Helius API error: {str(e)}")
         return None
 
+@metrics.traced("get_coin_data_batch")
+def get_coin_data_batch(contract_addresses, asset_platform_id='solana'):
+    """Resolve coin data for many mints with one cache lookup and chunked getAssetBatch calls
+
+    Returns a dict of mint -> coin data (None for mints Helius could not resolve).
+    Mints another call is already resolving are waited on rather than fetched
+    again, so wallets analyzed side by side look shared tokens up once.
+    """
+    api_key = os.environ.get("HeliusApi")
+    addresses = list(dict.fromkeys(contract_addresses))
+    cached = coin_cache.get_many([f"{asset_platform_id}-{address}" for address in addresses])
+
+    resolved = {}
+    missing = []
+    for address in addresses:
+        cache_key = f"{asset_platform_id}-{address}"
+        if cache_key in cached:
+            resolved[address] = cached[cache_key]
+            token_registry.remember(address, cached[cache_key])
+        else:
+            missing.append(address)
+
+    metrics.CACHE_REQUESTS.inc(len(resolved), cache="coin_data", result="hit")
+    metrics.CACHE_REQUESTS.inc(len(missing), cache="coin_data", result="miss")
+    if not missing:
+        return resolved
+
+    flight = singleflight.Flight()
+    flight.result = {}
+    joined = {}
+    owned = []
+    with _pending_assets_lock:
+        for address in missing:
+            cache_key = f"{asset_platform_id}-{address}"
+            other = _pending_assets.get(cache_key)
+            if other is None:
+                _pending_assets[cache_key] = flight
+                owned.append(address)
+            else:
+                joined[address] = other
+
+    try:
+        if owned:
+            resolved.update(fetch_coin_data_batch(owned, asset_platform_id, api_key))
+            flight.result.update((address, resolved.get(address)) for address in owned)
+    finally:
+        with _pending_assets_lock:
+            for address in owned:
+                _pending_assets.pop(f"{asset_platform_id}-{address}", None)
+        flight.done.set()
+
+    if joined:
+        singleflight.COALESCED.inc(len(joined), cache="coin_data", scope="process")
+    for address, other in joined.items():
+        other.done.wait()
+        # None if the other call failed before resolving it
+        resolved[address] = other.result.get(address)
+
+    return resolved
+
+def fetch_coin_data_batch(addresses, asset_platform_id, api_key):
+    """getAssetBatch lookups for uncached mints, cached as they arrive"""
+    print(f"Resolving {len(addresses)} token(s) via getAssetBatch")
+    url = HELIUS_RPC_URL + "?api-key=" + api_key
+    headers = {"Content-Type": "application/json"}
+    resolved = {}
+    fetched = {}
+
+    for start in range(0, len(addresses), ASSET_BATCH_SIZE):
+        chunk = addresses[start:start + ASSET_BATCH_SIZE]
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "batch",
+            "method": "getAssetBatch",
+            "params": {
+                "ids": chunk
+            }
+        }
+        try:
+            response = http_client.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            assets = response.json().get('result') or []
+        except requests.exceptions.RequestException as e:
+            print(f"Helius API error: {str(e)}")
+            for address in chunk:
+                resolved[address] = None
+            continue
+
+        # Results come back in request order, with null for unknown ids
+        for address, asset in zip(chunk, assets):
+            if not asset:
+                print(f"Token not found: {address}")
+                resolved[address] = None
+                continue
+            coin_data = parse_asset(asset)
+            resolved[address] = coin_data
+            fetched[f"{asset_platform_id}-{address}"] = coin_data
+            token_registry.remember(address, coin_data)
+
+    coin_cache.set_many(fetched)
+
+    return resolved
+
+def collect_mints(transactions):
+    """Unique token mints across all swap transfers in a batch"""
+    mints = {}
+    for tx in transactions:
+        if tx.get('type', '').upper() != 'SWAP':
+            continue
+        for transfer in tx.get('tokenTransfers', []):
+            mints[transfer.get('mint', 'Unknown Token')] = None
+    return list(mints)
+
 def analyze_swap_transactions(transactions, wallet_address):
     print(f"Analyzing {len(transactions)} raw transactions")  # Debug 1
     
     swap_transactions = []
     swap_count = 0  # Debug counter
 
+    # Resolve metadata for every mint in the batch up front
+    coin_map = get_coin_data_batch(collect_mints(transactions))
+
     for tx in transactions:
         # Debug: Print transaction type for first 5 transactions
         if swap_count < 5:
@@ -153,14 +312,15 @@ def analyze_swap_transactions(transactions, wallet_address):
             amount = float(transfer['tokenAmount'])
             mint = transfer.get('mint', 'Unknown Token')
             
-            # Get coin metadata
-            coin_data = get_coin_data(mint)
+            # Get coin metadata, falling back to the registry when Helius has no symbol
+            coin_data = coin_map.get(mint)
+            known = token_registry.get_token(mint) if not (coin_data and coin_data['symbol']) else None
             
             token_entry = {
-                'symbol': coin_data['symbol'] if coin_data else mint,
+                'symbol': coin_data['symbol'] if coin_data and coin_data['symbol'] else known['symbol'] if known else mint,
                 'address': mint,
                 'amount': amount,
-                'name': coin_data['name'] if coin_data else 'Unknown Token',
+                'name': known['name'] if known else coin_data['name'] if coin_data else 'Unknown Token',
                 'current_price': coin_data['current_price'] if coin_data else None
             }
             
@@ -172,6 +332,7 @@ def analyze_swap_transactions(transactions, wallet_address):
         if token_inputs or token_outputs:
             transaction_details = {
                 'time_ago': time_ago,
+                'signature': tx.get('signature'),
                 'timestamp': actual_time_stamp,
                 'time': datetime.fromtimestamp(actual_time_stamp).strftime("%Y-%m-%d %H:%M:%S"),
                 'source': source,
@@ -195,60 +356,184 @@ def analyze_swap_transactions(transactions, wallet_address):
     print(f"Found {swap_count} SWAP transactions out of {len(transactions)}")  # Debug 2
     return swap_transactions
 
-def get_transactions(wallet_address, cache_file='transactions_cache.json'):
-    """Fetch and cache filtered transactions"""
-    cache_key = f"{wallet_address}-filtered-transactions"
-    
+class SyncCancelled(Exception):
+    """Raised when a caller no longer needs a transaction sync in progress"""
+
+
+@metrics.traced("helius.transactions")
+def fetch_transaction_pages(wallet_address, until=None, max_pages=MAX_PAGES, cancelled=None):
+    """Walk a wallet's history newest-first by following the `before` cursor
+
+    Stops at `until` (exclusive) when given. Returns the raw transactions and
+    whether the walk reached `until` or the end of the history. `cancelled`
+    is checked before every page; once it returns True SyncCancelled is raised.
+    """
     api_key = os.environ.get("HeliusApi")
-    # Load cache
-    cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                cache = json.load(f)
-        except json.JSONDecodeError:
-            pass
-
-    # Cache check logic - return cached filtered results if valid
-    if cache_key in cache:
-        cache_entry = cache[cache_key]
-        cache_age = datetime.now() - datetime.fromisoformat(cache_entry['fetch_time'])
-        
-        if cache_age <= timedelta(hours=1):
-            return cache_entry['filtered_data']
+    url = f'{HELIUS_API_URL}/v0/addresses/{wallet_address}/transactions/'
+    params = {'api-key': api_key, 'limit': PAGE_SIZE}
+    if until:
+        params['until'] = until
 
-    # API call when no valid cache exists
-    url = f'https://api.helius.xyz/v0/addresses/{wallet_address}/transactions/'
-    params = {'api-key': api_key}
-    
-    print(f"Fetching fresh data from {url}")  # Debug 3
-    response = requests.get(url, params=params)
-    
-    # Save raw API response for debugging
-    with open('test.json', 'w') as f:
-        json.dump(response.json(), f, indent=2)
-    print("Saved raw API response to test.json")  # Debug 4
+    transactions = []
+    for _ in range(max_pages):
+        if cancelled and cancelled():
+            raise SyncCancelled(f"sync of {wallet_address} cancelled after {len(transactions)} transactions")
+        print(f"Fetching page from {url} before={params.get('before')}")  # Debug 3
+        response = http_client.get(url, params=params)
+        if response.status_code != 200:
+            raise Exception(f'API request failed: {response.status_code} - {response.text}')
+
+        page = response.json()
+        transactions.extend(page)
+        if len(page) < PAGE_SIZE:
+            return transactions, True
+        params['before'] = page[-1]['signature']
+
+    print(f"Stopped after {max_pages} pages")
+    return transactions, False
+
+def current_prices(mints):
+    """mint -> current USD price, from the coin cache or one getAssetBatch for expired mints
+
+    Mints that can't be resolved right now are left out.
+    """
+    return {mint: coin['current_price'] for mint, coin in get_coin_data_batch(mints).items() if coin}
+
+def with_current_prices(tokens, prices):
+    """Copies of token entries with current_price taken from `prices` where known"""
+    return [{**token, 'current_price': prices[token['address']]} if token['address'] in prices else token
+            for token in tokens]
+
+def present(swaps):
+    """Copies of stored swaps with time_ago and token prices as of now
+
+    Stored swaps keep the prices of the sync that found them, which can be
+    weeks old by the time an incremental sync leaves them untouched.
+    """
+    prices = current_prices({token['address'] for swap in swaps
+                             for token in swap['sold_tokens'] + swap['bought_tokens']})
+    return [{**swap,
+             'time_ago': get_time_ago(swap['timestamp']),
+             'sold_tokens': with_current_prices(swap['sold_tokens'], prices),
+             'bought_tokens': with_current_prices(swap['bought_tokens'], prices)}
+            for swap in swaps]
+
+@metrics.traced("get_transactions")
+def get_transactions(wallet_address, cancelled=None):
+    """Fetch and cache filtered transactions
+
+    The first call walks the full history. Later refreshes only fetch
+    transactions newer than the newest signature seen and prepend their
+    swaps to the stored analysis. Concurrent syncs of one wallet are
+    coalesced, and history up to TRANSACTIONS_MAX_STALE old is served at once
+    while it syncs in the background. A sync started with `cancelled` stops
+    once it returns True, unless another caller is waiting on it.
+    """
+    return present(load_transactions(wallet_address, cancelled)['filtered_data'])
+
+def priced_columns(store, start=None, end=None, mints=None):
+    """store.columns() with current prices for the tokens still held
 
-    if response.status_code != 200:
-        raise Exception(f'API request failed: {response.status_code} - {response.text}')
+    The store's token table only gets new prices when a token trades again,
+    so open positions are repriced through get_coin_data_batch first.
+    """
+    columns = store.columns(start, end, mints)
+    tokens = columns['tokens']
+    held = np.bincount(columns['mint'], weights=columns['amount'], minlength=len(tokens)) > 0
+    columns['tokens'] = with_current_prices(tokens, current_prices(
+        [token['address'] for token, open_position in zip(tokens, held) if open_position]))
+    return columns
 
-    raw_data = response.json()
-    print(f"Received {len(raw_data)} raw transactions")  # Debug 5
+def get_swap_store(wallet_address, cancelled=None):
+    """The wallet's columnar swap_store, synced like get_transactions"""
+    stored = load_transactions(wallet_address, cancelled)
+    store = swap_store.open_store(wallet_address)
+    if store.newest_signature != stored.get('newest_signature'):
+        # Written before the store existed, or by a sync that lost a race
+        store.record(stored)
+    return store
+
+def load_transactions(wallet_address, cancelled=None):
+    """The wallet's cached sync state, synced first when it is too old"""
+    cache_key = f"{wallet_address}-filtered-transactions"
+
+    # Cache check logic - return cached filtered results if still fresh
+    entry = transactions_cache.get_entry(cache_key)
+    stored = entry.value if entry else None
+    if stored:
+        cache_age = datetime.now() - datetime.fromisoformat(stored['fetch_time'])
+        if cache_age <= TRANSACTIONS_TTL:
+            metrics.cache_result("transactions", True)
+            return stored
+    metrics.cache_result("transactions", False)
+
+    def sync():
+        if cancelled is None:
+            return sync_transactions(wallet_address)
+        return sync_transactions(wallet_address, lambda: cancelled() and not singleflight.waiting(
+            transactions_cache, cache_key))
+
+    if stored and cache_age <= TRANSACTIONS_TTL + TRANSACTIONS_MAX_STALE:
+        singleflight.refresh(transactions_cache, cache_key, sync, lock_ttl=SYNC_LOCK_TTL)
+        return stored
+
+    def recheck():
+        # Skip this worker's memory tier to see a sync finished by another worker
+        current = transactions_cache.get_entry(cache_key, shared=True)
+        if current and datetime.now() - datetime.fromisoformat(current.value['fetch_time']) <= TRANSACTIONS_TTL:
+            return current.value
+        return None
+
+    return singleflight.do(transactions_cache, cache_key, sync, recheck=recheck, lock_ttl=SYNC_LOCK_TTL)
+
+def sync_transactions(wallet_address, cancelled=None):
+    """Bring a wallet's stored swaps and swap_store up to date; returns the stored sync state"""
+    cache_key = f"{wallet_address}-filtered-transactions"
+    entry = transactions_cache.get_entry(cache_key, shared=True)
+    stored = entry.value if entry else None
+
+    until = stored.get('newest_signature') if stored else None
+    raw_data, complete = fetch_transaction_pages(wallet_address, until=until, cancelled=cancelled)
     
-    # Process the data before caching
-    filtered_data = analyze_swap_transactions(raw_data, wallet_address)
-    print(f"Filtered down to {len(filtered_data)} swap transactions")  # Debug 6
+    if DUMP_RAW:
+        # Save raw API response for debugging
+        with open('test.json', 'w') as f:
+            json.dump(raw_data, f)
+        print("Saved raw API response to test.json")  # Debug 4
+
+    print(f"Received {len(raw_data)} new raw transactions")  # Debug 5
     
+    # Process the data before caching
+    new_swaps = analyze_swap_transactions(raw_data, wallet_address)
+    print(f"Filtered down to {len(new_swaps)} new swap transactions")  # Debug 6
+
+    if until and not complete:
+        # Too much new activity to bridge the gap, start over from this window
+        print(f"Incremental sync for {wallet_address} did not reach {until}, resetting history")
+        until = None
+
+    def merge(current):
+        # Another worker may have synced past our cursor in the meantime
+        if until and (current or {}).get('newest_signature') != until:
+            return None
+        previous = current['filtered_data'] if until else []
+        return {
+            'fetch_time': datetime.now().isoformat(),
+            'newest_signature': raw_data[0]['signature'] if raw_data else until,
+            'filtered_data': new_swaps + previous
+        }
+
     # Update cache with filtered results
-    cache[cache_key] = {
-        'fetch_time': datetime.now().isoformat(),
-        'filtered_data': filtered_data
-    }
-    
-    with open(cache_file, 'w') as f:
-        json.dump(cache, f, indent=2)
+    merged = transactions_cache.update(cache_key, merge)
+    if merged is None:
+        return transactions_cache.get_entry(cache_key, shared=True).value
 
-    return filtered_data
+    try:
+        # Append the new swaps to the columnar store (rebuilds it if it is behind)
+        swap_store.open_store(wallet_address).record(merged, new_swaps, previous_signature=until)
+    except OSError as e:
+        print(f"Swap store write for {wallet_address} failed: {e}")
+    return merged
 
 if __name__ == "__main__":
     import json
@@ -1,63 +1,111 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
+import hashlib
 import json
-import telebot
+import time
 import os
-import asyncio
-from dotenv import load_dotenv
-from pymongo import MongoClient
+import clients
 import database
-import ai
-import re
-import markdown
+import metrics
+import telegram_format
+from update_queue import UpdateQueue
 
-load_dotenv(override=True)
+# ai, prefetch and telebot are imported on first use so workers
+# boot fast; nothing here opens a connection before a request needs it
 
 app = Flask(__name__)
 CORS(app)
 
-bot_token = os.environ.get("TelegramBotToken")
-bot = telebot.TeleBot(bot_token)
-
-MONGO_URL = os.getenv('MONGO_URL')
-client = MongoClient(MONGO_URL)
-db = client['Chat']  
-client = MongoClient(MONGO_URL)
-conversations = db["conversations"]
-
-def remove_unsupported_tags(html_string):
-
-  supported_tags = ["b", "strong", "i", "em", "a", "code", "pre"]
-  
-  pattern = r"<[^>]+>" 
-  
-  def replace_tag(match):
-    tag = match.group(0)
-    
-    if any(tag.startswith(f"<{supported_tag}") or tag.startswith(f"</{supported_tag}") for supported_tag in supported_tags):
-      return tag  
-    else:
-      return ""  
-  
-  clean_string = re.sub(pattern, replace_tag, html_string)
-  return clean_string
+
+def telegram():
+    """This process's bot, with the chat handler registered when it is created"""
+    return clients.bot(lambda bot: bot.register_message_handler(chat, func=lambda message: True))
+
+
+updates = UpdateQueue(lambda update: telegram().process_new_updates([update]),
+                      lambda chat_id: telegram().send_chat_action(chat_id, 'typing'))
+
+EDIT_INTERVAL = 1.5  # seconds between progressive Telegram edits
+TELEGRAM_MAX_LENGTH = telegram_format.MAX_LENGTH
+
+def send_html(bot, chat_id, message, message_id=None):
+    """Send (or edit into message_id) one rendered message, as plain text if Telegram rejects the HTML"""
+    from telebot.apihelper import ApiTelegramException
+    try:
+        if message_id is None:
+            bot.send_message(chat_id, message, parse_mode='HTML')
+        else:
+            bot.edit_message_text(message, chat_id, message_id, parse_mode='HTML')
+    except ApiTelegramException as e:
+        if "message is not modified" in str(e):
+            return
+        print(f"Telegram rejected HTML, sending plain text: {e}")
+        plain = telegram_format.to_plain(message)
+        if message_id is None:
+            bot.send_message(chat_id, plain)
+        else:
+            bot.edit_message_text(plain, chat_id, message_id)
+
+@app.before_request
+def start_request():
+    g.started_at = time.perf_counter()
+    metrics.new_request_id(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request(response):
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.started_at,
+                                 endpoint=request.endpoint or 'unknown', status=response.status_code)
+    response.headers['X-Request-ID'] = metrics.request_id()
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def hello():
     return f"Hello, World!"
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving requests"""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: Mongo answers a ping and the shared cache is writable"""
+    import cache
+    checks = {}
+    try:
+        clients.mongo().admin.command('ping')
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = str(e)
+    try:
+        cache._connect().execute("SELECT 1")
+        checks["cache"] = "ok"
+    except Exception as e:
+        checks["cache"] = str(e)
+    ready = all(value == "ok" for value in checks.values())
+    return jsonify({"status": "ok" if ready else "unavailable", "checks": checks}), 200 if ready else 503
+
 @app.route('/bot', methods=['POST'])
 def telegram_bot():
+    from telebot.types import Update
     try:
-        update = telebot.types.Update.de_json(request.get_json(force=True))
-        bot.process_new_updates([update])
+        update = Update.de_json(request.get_json(force=True))
+        # Acknowledge right away, the answer is sent from a worker thread
+        if not updates.submit(update):
+            return "Busy", 503
         return "!", 200
     except Exception as e:
         print(f"Error processing Telegram update: {e}")
         return "Error", 500
 
-@bot.message_handler(func=lambda message: True)
 def chat(user):
+    import ai
+    import prefetch
+    bot = telegram()
     try:
         user_id = user.chat.id
         if user.text == "/reset":
@@ -66,22 +114,43 @@ def chat(user):
         prompt = [
                     {"text": user.text},  
                 ]    
+        # Look up pasted addresses while the model decides what to do with them
+        lookups = prefetch.start(user.text)
         database.register(user_id)
         conversation = database.add_message(user_id,prompt,"user")
         llm = ai.llm()
         
-        response = llm.generate_response(user_id,conversation)
-        print(f"final response: {response}")
+        # Show the answer as it streams, editing one message at a throttled rate
+        chunks = []
+        sent = None
+        last_edit = 0
+        try:
+            for text in llm.stream_response(user_id,conversation):
+                chunks.append(text)
+                partial = "".join(chunks)
+                if len(partial) > TELEGRAM_MAX_LENGTH or time.monotonic() - last_edit < EDIT_INTERVAL:
+                    continue
+                if sent is None:
+                    sent = bot.send_message(user_id,partial)
+                else:
+                    bot.edit_message_text(partial,user_id,sent.message_id)
+                last_edit = time.monotonic()
+        finally:
+            lookups.cancel()
+
+        response_message = "".join(chunks)
+        print(f"final response: {response_message}")
         response = [
-                    {"text": response},  
+                    {"text": response_message},  
                 ] 
-        database.add_message(user_id,response,"model")
-        response_message = response[0].get("text")
+        database.add_messages(user_id,[{"role":"model","parts":response}])
 
 
-        escaped_response = markdown.markdown(response_message)
-        escaped_response = remove_unsupported_tags(escaped_response)
-        bot.send_message(user_id,escaped_response,parse_mode='HTML')
+        with metrics.span("render_markdown"):
+            messages = telegram_format.render_messages(response_message, TELEGRAM_MAX_LENGTH)
+        # The streamed message becomes the first part, long answers continue in new messages
+        for i, message in enumerate(messages):
+            send_html(bot, user_id, message, sent.message_id if sent is not None and i == 0 else None)
     except Exception as e:
         print(f"error: {e}")
        
@@ -96,6 +165,10 @@ def api_send_message():
         if not user_id or not message_text:
             return jsonify({"status": "error", "message": "Missing user_id or message"}), 400
         
+        import ai
+        import prefetch
+        lookups = prefetch.start(message_text)
+
         # Database operations
         database.register(user_id)
         prompt = [{"text": message_text}]
@@ -103,9 +176,12 @@ def api_send_message():
         
         # Generate AI response
         llm = ai.llm()
-        ai_response = llm.generate_response(user_id, conversation)
+        try:
+            ai_response = llm.generate_response(user_id, conversation)
+        finally:
+            lookups.cancel()
         response_data = [{"text": ai_response}]
-        database.add_message(user_id, response_data, "model")
+        database.add_messages(user_id, [{"role": "model", "parts": response_data}])
         
         return jsonify({
             "status": "success",
@@ -115,6 +191,75 @@ def api_send_message():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def api_stream_message():
+    """Server-sent events: `data` events carry text chunks, then one `done` or `error` event"""
+    data = request.get_json()
+    user_id = data.get('user_id')
+    message_text = data.get('message')
+
+    if not user_id or not message_text:
+        return jsonify({"status": "error", "message": "Missing user_id or message"}), 400
+
+    import ai
+    import prefetch
+    lookups = prefetch.start(message_text)
+    database.register(user_id)
+    prompt = [{"text": message_text}]
+    conversation = database.add_message(user_id, prompt, "user")
+
+    def events():
+        chunks = []
+        try:
+            llm = ai.llm()
+            for text in llm.stream_response(user_id, conversation):
+                chunks.append(text)
+                yield f"data: {json.dumps({'text': text})}\n\n"
+
+            ai_response = "".join(chunks)
+            database.add_messages(user_id, [{"role": "model", "parts": [{"text": ai_response}]}])
+            yield f"event: done\ndata: {json.dumps({'response': ai_response, 'conversation_id': user_id})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+        finally:
+            lookups.cancel()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/wallets/analyze', methods=['POST'])
+def api_analyze_wallets():
+    """NDJSON: one line per wallet as its analysis finishes, then a summary line"""
+    import wallet_batch
+    data = request.get_json(silent=True) or {}
+    wallets = data.get('wallets')
+
+    if not isinstance(wallets, list) or not wallets or not all(isinstance(w, str) for w in wallets):
+        return jsonify({"status": "error", "message": "wallets must be a non-empty list of addresses"}), 400
+    if len(wallets) > wallet_batch.MAX_WALLETS:
+        return jsonify({"status": "error", "message": f"at most {wallet_batch.MAX_WALLETS} wallets per request"}), 400
+    try:
+        concurrency = int(data.get('concurrency') or wallet_batch.WORKERS)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "concurrency must be an integer"}), 400
+
+    def lines():
+        started = time.perf_counter()
+        statuses = {}
+        results = wallet_batch.analyze_wallets(wallets, concurrency)
+        try:
+            for row in results:
+                statuses[row['status']] = statuses.get(row['status'], 0) + 1
+                yield json.dumps(row) + "\n"
+            yield json.dumps({"done": True, "wallets": sum(statuses.values()), "statuses": statuses,
+                              "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}) + "\n"
+        finally:
+            # Stops the batch when the client goes away
+            results.close()
+
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/chat/reset', methods=['POST'])
 def api_reset():
     try:
@@ -133,36 +278,61 @@ def api_reset():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/api/chat/history', methods=['POST'])
+HISTORY_PAGE_SIZE = int(os.environ.get("HistoryPageSize", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+@app.route('/api/chat/history', methods=['GET', 'POST'])
 def api_history():
+    """Newest-first page of a chat's text messages
+
+    Takes user_id, limit and before (the next_before of the previous page)
+    as JSON or query parameters. Responses carry an ETag; a poll that sends
+    it back in If-None-Match gets 304 while the page is unchanged.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or request.args
         user_id = data.get('user_id')
         
         if not user_id:
             return jsonify({"status": "error", "message": "Missing user_id"}), 400
-            
-        conversation = database.get_conversation(user_id)
-        
+        try:
+            limit = min(max(int(data.get('limit') or HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+            before = int(data['before']) if data.get('before') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "limit and before must be integers"}), 400
+
+        page = database.get_history(user_id, limit, before) or {"total": 0, "first": 0, "start": 0, "messages": []}
+
+        # Numbers only move when messages are added, trimmed or reset; the
+        # user part keeps chats with matching counts apart (POST shares one URL)
+        user_tag = hashlib.sha256(str(user_id).encode()).hexdigest()[:16]
+        etag = f'"{user_tag}.{page["total"]}.{page["first"]}.{before}.{limit}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag})
+
+        messages = page["messages"]
+        # A full page continues from its oldest message, a short one from where its scan stopped
+        next_before = messages[0]["seq"] if len(messages) == limit else page["start"]
+
         # Process conversation history
         processed_history = [
             {
                 "role": msg["role"],
-                "message": part["text"]
+                "message": text,
+                "seq": msg["seq"]
             }
-            for msg in reversed(conversation)
-            for part in msg["parts"]
-            if msg["role"] in ["user", "model"]
-            and "text" in part
-            and not part.get("functionCall")
-            and not part.get("functionResponse")
+            for msg in reversed(messages)
+            for text in msg["texts"]
         ]
 
-        return jsonify({
+        response = jsonify({
             "status": "success",
             "user_id": user_id,
-            "history": processed_history
+            "history": processed_history,
+            "next_before": next_before if next_before > page["first"] else None
         })
+        response.headers['ETag'] = etag
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
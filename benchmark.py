@@ -0,0 +1,671 @@
+"""Offline latency benchmark for the chat pipeline
+
+Starts local stand-ins for Helius, BirdEye, Gemini and Telegram that replay
+the payloads captured in this repo (transactions.json, coin_data_cache.json,
+token_price_history.json), swaps MongoDB for an in-memory collection, and
+drives the analyzers, the model loop and the Flask endpoints through a set
+of scenarios. Reports per-stage timings, p50/p99 latency and peak
+allocations, and compares them with the baseline committed in
+benchmark_baseline.json. Timings depend on the machine, so re-save the
+baseline on the machine the comparison runs on before relying on it.
+
+    python benchmark.py                       # run and compare with benchmark_baseline.json
+    python benchmark.py --latency 50          # add 50 ms to every stub response
+    python benchmark.py --save-baseline       # store this run as the new baseline
+"""
+import argparse
+import copy
+import inspect
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(ROOT, "benchmark_baseline.json")
+WALLET = "CkBWowCj1SFFVDk8Fkn9b2S3gV8kgBm9MEPG2YQvmhFB"
+SECOND_WALLET = "9WzDXwBbmkg8ZTbNMqUxvQRAyrZzDsGYdLVL9zYtAWWM"
+ADDRESS_PATTERN = re.compile(r"\b[1-9A-HJ-NP-Za-km-z]{32,44}\b")
+
+
+def load(name):
+    with open(os.path.join(ROOT, name)) as f:
+        return json.load(f)
+
+
+# ---------------------------------------------------------------------------
+# Provider stand-ins
+
+
+class Stub(BaseHTTPRequestHandler):
+    """Base handler: JSON in/out with a configurable artificial latency"""
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment, otherwise delayed ACKs add ~40 ms per call
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def reply(self, payload, status=200):
+        time.sleep(self.latency)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class HeliusStub(Stub):
+    transactions = []
+    assets = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        transactions = self.transactions
+        signatures = [tx["signature"] for tx in transactions]
+        if params.get("until") in signatures:
+            transactions = transactions[:signatures.index(params["until"])]
+        if params.get("before") in signatures:
+            transactions = transactions[signatures.index(params["before"]) + 1:]
+        self.reply(transactions[:int(params.get("limit", 100))])
+
+    def asset(self, mint):
+        data = self.assets.get(mint) or {"name": f"Token {mint[:4]}", "symbol": mint[:4], "current_price": 0.001}
+        return {"id": mint,
+                "content": {"metadata": {"name": data["name"]}},
+                "token_info": {"symbol": data["symbol"], "price_info": {"price_per_token": data["current_price"]}}}
+
+    def do_POST(self):
+        request = self.body()
+        if request.get("method") == "getAssetBatch":
+            result = [None if mint == WALLET else self.asset(mint) for mint in request["params"]["ids"]]
+        elif request["params"]["id"] == WALLET:
+            # Wallets are not assets
+            self.reply({"jsonrpc": "2.0", "id": request.get("id"),
+                        "error": {"code": -32000, "message": "Asset Not Found"}})
+            return
+        else:
+            result = self.asset(request["params"]["id"])
+        self.reply({"jsonrpc": "2.0", "id": request.get("id"), "result": result})
+
+
+class BirdEyeStub(Stub):
+    items = []
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        start, end = int(params["time_from"]), int(params["time_to"])
+        items = [item for item in self.items if start <= item["unixTime"] <= end]
+        self.reply({"success": True, "data": {"items": items}})
+
+
+class GeminiStub(Stub):
+    """Calls get_user_trades for each address in the latest user message, else answers"""
+    answer = ("haha nice try anon 😂 **three swaps** in and you're already *down bad* on WINNIE.\n\n"
+              "- bought PYTHIA with 1 SOL\n- dumped WINNIE twice\n\nmaybe touch grass before the next ape?")
+
+    def model_turn(self, request):
+        contents = request.get("contents", [])
+        last = contents[-1] if contents else {}
+        if ("tools" in request or "cachedContent" in request) and last.get("role") == "user":
+            text = " ".join(part.get("text", "") for part in last.get("parts", []))
+            addresses = list(dict.fromkeys(ADDRESS_PATTERN.findall(text)))
+            if addresses:
+                return [{"functionCall": {"name": "get_user_trades", "args": {"wallet_address": address}}}
+                        for address in addresses]
+        return [{"text": self.answer}]
+
+    def cached_content(self):
+        expires = datetime.fromtimestamp(time.time() + 3600, timezone.utc)
+        self.reply({"name": "cachedContents/bench", "expireTime": expires.strftime("%Y-%m-%dT%H:%M:%S.%fZ")})
+
+    do_PATCH = cached_content
+
+    def do_POST(self):
+        request = self.body()
+        if "/cachedContents" in self.path:
+            self.cached_content()
+            return
+        parts = self.model_turn(request)
+        if ":streamGenerateContent" not in self.path:
+            self.reply({"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}]})
+            return
+
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if "text" in parts[0]:
+            words = parts[0]["text"].split(" ")
+            parts = [{"text": word + " "} for word in words]
+        for part in parts:
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [part]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+
+class TelegramStub(Stub):
+    def do_POST(self):
+        self.reply({"ok": True, "result": {"message_id": 1, "date": int(time.time()),
+                                           "chat": {"id": 1, "type": "private"}, "text": ""}})
+
+    do_GET = do_POST
+
+
+def start(handler, latency):
+    handler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+# ---------------------------------------------------------------------------
+# In-memory MongoDB stand-in
+
+
+class MemoryCollection:
+    """Just enough of pymongo's Collection for database.py"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _project(doc, projection):
+        if doc is None:
+            return None
+        doc = copy.deepcopy(doc)
+        if not projection:
+            return doc
+        out = {} if any(v for k, v in projection.items() if k != "_id") else dict(doc)
+        for key, value in projection.items():
+            if isinstance(value, dict) and "$slice" in value and key in doc:
+                window = value["$slice"]
+                if isinstance(window, list):
+                    out[key] = doc[key][window[0]:window[0] + window[1]] if window[0] >= 0 \
+                        else doc[key][max(len(doc[key]) + window[0], 0):][:window[1]]
+                else:
+                    out[key] = doc[key][window:] if window < 0 else doc[key][:window]
+            elif value and key in doc:
+                out[key] = doc[key]
+            elif not value:
+                out.pop(key, None)
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+
+    def _apply(self, doc, update, inserted):
+        for key, value in update.get("$set", {}).items():
+            doc[key] = copy.deepcopy(value)
+        for key in update.get("$unset", {}):
+            doc.pop(key, None)
+        for key, value in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + value
+        if inserted:
+            for key, value in update.get("$setOnInsert", {}).items():
+                doc[key] = copy.deepcopy(value)
+        for key, value in update.get("$push", {}).items():
+            items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+            array = doc.setdefault(key, []) + copy.deepcopy(items)
+            if isinstance(value, dict) and "$slice" in value:
+                array = array[value["$slice"]:] if value["$slice"] < 0 else array[:value["$slice"]]
+            doc[key] = array
+
+    def _update(self, query, update, upsert):
+        with self.lock:
+            doc = self.docs.get(query["_id"])
+            inserted = doc is None
+            if inserted:
+                if not upsert:
+                    return None
+                doc = self.docs[query["_id"]] = {"_id": query["_id"]}
+            self._apply(doc, update, inserted)
+            return doc
+
+    def find_one(self, query, projection=None):
+        return self._project(self.docs.get(query["_id"]), projection)
+
+    def insert_one(self, doc):
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+
+    def update_one(self, query, update, upsert=False):
+        self._update(query, update, upsert)
+
+    def find_one_and_update(self, query, update, projection=None, return_document=False, upsert=False):
+        doc = self._update(query, update, upsert)
+        return self._project(doc, projection)
+
+    def aggregate(self, pipeline):
+        # Stages build new documents and never modify their input, so no copies
+        match = pipeline[0].get("$match", {})
+        docs = [self.docs[match["_id"]]] if match.get("_id") in self.docs else [] if "_id" in match \
+            else list(self.docs.values())
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = [doc for doc in docs if all(doc.get(k) == v for k, v in spec.items())]
+            elif name == "$addFields":
+                docs = [{**doc, **{k: evaluate(v, doc, {}) for k, v in spec.items()}} for doc in docs]
+            elif name == "$project":
+                docs = [{k: doc.get(k) if v in (1, True) else evaluate(v, doc, {})
+                         for k, v in spec.items() if v not in (0, False)} for doc in docs]
+            else:
+                raise NotImplementedError(name)
+        return iter(docs)
+
+
+def lookup(path, doc, variables):
+    """Value of a "$field.sub" or "$$var.sub" path"""
+    if path.startswith("$$"):
+        name, _, rest = path[2:].partition(".")
+        value = variables[name]
+    else:
+        value, rest = doc, path[1:]
+    for key in rest.split(".") if rest else []:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def evaluate(expr, doc, variables):
+    """The aggregation expression operators database.py uses"""
+    if isinstance(expr, str):
+        return lookup(expr, doc, variables) if expr.startswith("$") else expr
+    if isinstance(expr, list):
+        return [evaluate(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if not (len(expr) == 1 and next(iter(expr)).startswith("$")):
+        return {k: evaluate(v, doc, variables) for k, v in expr.items()}
+    (op, arg), = expr.items()
+
+    def ev(e, extra=None):
+        return evaluate(e, doc, {**variables, **(extra or {})})
+
+    if op in ("$map", "$filter"):
+        items, name = ev(arg["input"]) or [], arg.get("as", "this")
+        if op == "$map":
+            return [ev(arg["in"], {name: item}) for item in items]
+        return [item for item in items if ev(arg["cond"], {name: item})]
+    if op == "$let":
+        return ev(arg["in"], {k: ev(v) for k, v in arg["vars"].items()})
+    args = ev(arg)
+    if op == "$ifNull":
+        return args[0] if args[0] is not None else args[1]
+    if op == "$type":
+        return "string" if isinstance(args, str) else "missing" if args is None else "object"
+    operators = {
+        "$size": lambda a: len(a), "$max": max, "$min": min, "$and": all,
+        "$add": sum, "$subtract": lambda a, b: a - b, "$range": lambda a, b: list(range(a, b)),
+        "$arrayElemAt": lambda a, i: a[i], "$in": lambda a, b: a in b, "$gt": lambda a, b: a > b,
+        "$eq": lambda a, b: a == b, "$slice": lambda a, n: a[n:] if n < 0 else a[:n],
+    }
+    return operators[op](args) if op in ("$size", "$max", "$min", "$and", "$add") else operators[op](*args)
+
+
+class MemoryAdmin:
+    def command(self, name):
+        return {"ok": 1.0}
+
+
+class MemoryClient:
+    def __init__(self, *args, **kwargs):
+        self.databases = defaultdict(lambda: defaultdict(MemoryCollection))
+        self.admin = MemoryAdmin()
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+
+
+class Stages:
+    """Wraps functions to accumulate wall time per pipeline stage (inclusive of nested stages)"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def wrap(self, module, name, stage):
+        original = getattr(module, name)
+
+        def add(seconds):
+            with self.lock:
+                self.totals[stage] += seconds
+
+        def timed_iteration(generator):
+            # Streaming functions do their work while being consumed
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    add(time.perf_counter() - started)
+                    return
+                add(time.perf_counter() - started)
+                yield item
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                add(time.perf_counter() - started)
+            return timed_iteration(result) if inspect.isgenerator(result) else result
+
+        setattr(module, name, timed)
+
+    def take(self):
+        totals = dict(self.totals)
+        self.totals.clear()
+        return totals
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name, fn, iterations, stages, reset=None):
+    if reset:
+        reset()
+    fn()  # warm-up (imports, connection pools)
+    stages.take()
+
+    samples = []
+    stage_samples = defaultdict(list)
+    for _ in range(iterations):
+        if reset:
+            reset()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        for stage, seconds in stages.take().items():
+            stage_samples[stage].append(seconds * 1000)
+
+    if reset:
+        reset()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stages.take()
+
+    return {
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+        "stages_ms": {stage: round(statistics.fmean(values), 3) for stage, values in sorted(stage_samples.items())},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+
+
+def setup(latency):
+    """Point every provider at local stubs and MongoDB at memory, then import the app"""
+    HeliusStub.transactions = load("transactions.json")
+    HeliusStub.assets = {key.split("-", 1)[1]: entry["data"] for key, entry in load("coin_data_cache.json").items()}
+    BirdEyeStub.items = [
+        {"unixTime": item["timestamp"], "value": float(item["price"].split()[0])}
+        for entry in load("token_price_history.json").values() for item in entry["items"]
+    ]
+
+    helius = start(HeliusStub, latency)
+    os.environ.update({
+        "HeliusApiUrl": helius,
+        "HeliusRpcUrl": helius + "/",
+        "BirdEyeApiUrl": start(BirdEyeStub, latency),
+        "GeminiApiUrl": start(GeminiStub, latency),
+        "CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-"), "cache.db"),
+    })
+    telegram = start(TelegramStub, latency)
+
+    import pymongo
+    pymongo.MongoClient = MemoryClient
+
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="bench-cwd-"))  # keep debug dumps out of the tree
+    import telebot.apihelper
+    telebot.apihelper.API_URL = telegram + "/bot{0}/{1}"
+    import app
+    return app
+
+
+def scenarios(app):
+    import telebot
+    import ai
+    import cache
+    import database
+    import analyze_transactions
+    import analytics
+    import telegram_format
+    from analyze_tokens import get_historical_prices
+
+    raw = load("transactions.json")
+    client = app.app.test_client()
+    counter = iter(range(10 ** 9))
+
+    def cold():
+        for namespace in cache._namespaces.values():
+            namespace.clear()
+
+    def fresh_user():
+        user_id = f"bench-{next(counter)}"
+        database.register(user_id)
+        return user_id
+
+    def chat_turn(text):
+        user_id = fresh_user()
+        conversation = database.add_message(user_id, [{"text": text}], "user")
+        return ai.llm().generate_response(user_id, conversation)
+
+    def long_history():
+        user_id = "bench-history"
+        database.reset_conversation(user_id)
+        database.register(user_id)
+        for i in range(100):
+            database.add_messages(user_id, [
+                {"role": "user", "parts": [{"text": f"message {i}"}]},
+                {"role": "model", "parts": [{"functionCall": {"name": "get_user_trades", "args": {"wallet_address": WALLET}}}]},
+                {"role": "function", "parts": [{"functionResponse": {"name": "get_user_trades", "response": {
+                    "name": "get_user_trades", "content": "x" * 2000}}}]},
+                {"role": "model", "parts": [{"text": f"answer {i}"}]},
+            ])
+        return user_id
+
+    def repeat_turn():
+        # The same opening prompt from a new user each time, only the first run reaches Gemini
+        return chat_turn("gm")
+
+    history_user = {}
+
+    def history():
+        history_user.setdefault("id", long_history())
+        response = client.post("/api/chat/history", json={"user_id": history_user["id"]})
+        assert response.status_code == 200, response.data
+
+    def history_poll():
+        history_user.setdefault("id", long_history())
+        etag = history_user.get("etag")
+        response = client.get("/api/chat/history", query_string={"user_id": history_user["id"]},
+                              headers={"If-None-Match": etag} if etag else {})
+        assert response.status_code in (200, 304), response.data
+        history_user["etag"] = response.headers["ETag"]
+
+    def send_message():
+        response = client.post("/api/chat/send_message", json={"user_id": fresh_user(), "message": f"check {WALLET}"})
+        assert response.status_code == 200, response.data
+
+    def telegram_chat():
+        message = telebot.types.Message.de_json({
+            "message_id": next(counter), "date": int(time.time()), "text": f"gm {next(counter)}",
+            "chat": {"id": next(counter), "type": "private"}})
+        app.chat(message)
+
+    def stream_message():
+        response = client.post("/api/chat/stream", json={"user_id": fresh_user(), "message": f"gm {next(counter)}"})
+        assert b"event: done" in response.data, response.data
+
+    long_answer = "\n".join(f"- swap {i}: **bought** `TOKEN{i}` for {i * 0.1:.2f} SOL, _nice_ <3" for i in range(400))
+
+    batch_wallets = [WALLET, SECOND_WALLET] + [
+        address for address in ADDRESS_PATTERN.findall(json.dumps(raw)) if address not in (WALLET, SECOND_WALLET)
+    ]
+    batch_wallets = list(dict.fromkeys(batch_wallets))[:20]
+
+    def analyze_wallets():
+        response = client.post('/api/wallets/analyze', json={'wallets': batch_wallets})
+        return response.get_data()
+
+    def wallet_pnl_from_store():
+        store = analyze_transactions.get_swap_store(WALLET)
+        return analytics.columns_pnl(store.columns(), store.swap_count)
+
+    def import_app():
+        # A fresh interpreter, as a newly spawned worker would be
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+        subprocess.run([sys.executable, "-c", "import app"], env=env, check=True)
+
+    def ready():
+        response = client.get("/readyz")
+        assert response.status_code == 200, response.data
+
+    return [
+        ("startup/import_app", import_app, None),
+        ("startup/readyz", ready, None),
+        ("analyze_swap_transactions/cold", lambda: analyze_transactions.analyze_swap_transactions(raw, WALLET), cold),
+        ("analyze_swap_transactions/warm", lambda: analyze_transactions.analyze_swap_transactions(raw, WALLET), None),
+        ("get_transactions/cold", lambda: analyze_transactions.get_transactions(WALLET), cold),
+        ("get_transactions/warm", lambda: analyze_transactions.get_transactions(WALLET), None),
+        ("wallet_pnl/swap_list", lambda: analytics.wallet_pnl(analyze_transactions.get_transactions(WALLET)), None),
+        ("wallet_pnl/swap_store", lambda: wallet_pnl_from_store(), None),
+        ("find_token/symbol", lambda: ai.llm().call_tool({"name": "find_token", "args": {"query": "$winnie"}}, None), None),
+        ("get_historical_prices/cold", lambda: get_historical_prices(
+            "CreiuhfwdWCN5mJbMJtA9bBpYQrQF2tCBuZwSPWfpump", 1737772532, 1738647000, target_points=50), cold),
+        ("generate_response/text", lambda: chat_turn(f"gm {next(counter)}"), None),
+        ("generate_response/repeat", repeat_turn, None),
+        ("generate_response/tool_call", lambda: chat_turn(f"how am I doing? {WALLET}"), cold),
+        ("generate_response/two_wallets", lambda: chat_turn(f"compare {WALLET} with {SECOND_WALLET}"), cold),
+        ("api/send_message", send_message, None),
+        ("api/send_message/cold", send_message, cold),
+        ("api/stream", stream_message, None),
+        ("api/history/400_messages", history, None),
+        ("api/history/poll_unchanged", history_poll, None),
+        ("api/wallets_analyze/20_wallets", analyze_wallets, cold),
+        ("telegram/chat_handler", telegram_chat, None),
+        ("telegram/render_long_answer", lambda: telegram_format.render_messages(long_answer), None),
+    ]
+
+
+def instrument(stages):
+    import ai
+    import database
+    import analyze_transactions
+    import analyze_tokens
+
+    stages.wrap(analyze_transactions, "fetch_transaction_pages", "helius.transactions")
+    stages.wrap(analyze_transactions, "get_coin_data_batch", "helius.assets")
+    stages.wrap(analyze_tokens, "fetch_price_history", "birdeye")
+    stages.wrap(ai.llm, "request_model", "gemini")
+    stages.wrap(ai.llm, "stream_model", "gemini.stream")
+    stages.wrap(ai.llm, "function_call", "tools")
+    for name in ("add_message", "add_messages", "get_conversation", "register"):
+        if hasattr(database, name):
+            stages.wrap(database, name, "mongo")
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if before[metric] and result[metric] > before[metric] * (1 + threshold) and result[metric] - before[metric] > 1:
+                regressions.append(f"{name} {metric}: {before[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0, help="artificial stub latency in ms")
+    parser.add_argument("--only", help="run scenarios whose name contains this text")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # The pipeline prints a lot of debug output, keep the report readable
+    report = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        app = setup(args.latency / 1000)
+        stages = Stages()
+        instrument(stages)
+        results = {}
+        for name, fn, reset in scenarios(app):
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(name, fn, args.iterations, stages, reset)
+    finally:
+        sys.stdout.close()
+        sys.stdout = report
+
+    if not results:
+        print(f"no scenario matches {args.only!r}")
+        return 1
+    width = max(len(name) for name in results)
+    print(f"{'scenario':<{width}}  {'p50 ms':>9} {'p99 ms':>9} {'peak KB':>9}  stages (mean ms)")
+    for name, result in results.items():
+        stage_text = ", ".join(f"{stage}={ms}" for stage, ms in result["stages_ms"].items())
+        print(f"{name:<{width}}  {result['p50_ms']:>9} {result['p99_ms']:>9} {result['peak_alloc_kb']:>9}  {stage_text}")
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline saved to {BASELINE_FILE}")
+        return 0
+
+    if not os.path.exists(BASELINE_FILE):
+        print("\nno baseline stored yet, run with --save-baseline to create one")
+        return 0
+
+    with open(BASELINE_FILE) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print("\nregressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nno regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
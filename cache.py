@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+CACHE_PATH = os.environ.get("CACHE_PATH", "cache.db")
+MEMORY_ENTRIES = int(os.environ.get("CACHE_MEMORY_ENTRIES", "512"))
+EVICT_EVERY = 64  # writes between LRU trims of the shared store
+# Reads only bump accessed_at once it is this many seconds old, so hot keys
+# don't turn every read into a write
+TOUCH_INTERVAL = int(os.environ.get("CACHE_TOUCH_INTERVAL", "60"))
+
+Entry = namedtuple("Entry", ["value", "stored_at", "expires_at"])
+
+_local = threading.local()
+_namespaces = {}
+_namespaces_lock = threading.Lock()
+
+
+def _connect():
+    """Per-thread, per-process SQLite connection in WAL mode"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+
+    conn = sqlite3.connect(CACHE_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            expires_at REAL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS locks (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )""")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+class Cache:
+    """Two-tier key/value cache: an in-process LRU in front of a shared SQLite store
+
+    Entries carry a TTL. Expired entries stay readable through get_entry (for
+    callers that want to serve stale data) until LRU eviction drops them.
+    """
+
+    def __init__(self, namespace, ttl=None, max_entries=10000, memory_entries=MEMORY_ENTRIES):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    @staticmethod
+    def _is_fresh(entry):
+        return entry.expires_at is None or entry.expires_at > time.time()
+
+    def get_entry(self, key, shared=False):
+        """Return the Entry for key, expired or not, or None if absent
+
+        With shared=True the in-process tier is skipped, so writes made by
+        other workers are seen immediately.
+        """
+        entry = None
+        if not shared:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+            if entry is not None and self._is_fresh(entry):
+                return entry
+
+        conn = _connect()
+        row = conn.execute(
+            "SELECT value, stored_at, expires_at, accessed_at FROM entries WHERE namespace = ? AND key = ?",
+            (self.namespace, key)).fetchone()
+        if row is None:
+            return entry
+        entry = Entry(json.loads(row[0]), row[1], row[2])
+        now = time.time()
+        if now - row[3] >= TOUCH_INTERVAL:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, key))
+        self._remember(key, entry)
+        return entry
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        if entry is None or not self._is_fresh(entry):
+            return default
+        return entry.value
+
+    def get_many(self, keys):
+        """Fresh values for keys in one query; missing or expired keys are left out"""
+        found = {}
+        pending = []
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None and self._is_fresh(entry):
+                    self._memory.move_to_end(key)
+                    found[key] = entry.value
+                else:
+                    pending.append(key)
+
+        conn = _connect()
+        now = time.time()
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(pending), 500):
+            chunk = pending[start:start + 500]
+            rows = conn.execute(
+                "SELECT key, value, stored_at, expires_at, accessed_at FROM entries "
+                f"WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                (self.namespace, *chunk)).fetchall()
+            stale = []
+            for key, value, stored_at, expires_at, accessed_at in rows:
+                entry = Entry(json.loads(value), stored_at, expires_at)
+                if self._is_fresh(entry):
+                    self._remember(key, entry)
+                    found[key] = entry.value
+                if now - accessed_at >= TOUCH_INTERVAL:
+                    stale.append(key)
+            if stale:
+                conn.execute(
+                    f"UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key IN ({','.join('?' * len(stale))})",
+                    (now, self.namespace, *stale))
+        return found
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, items, ttl=None):
+        """Store several values atomically in a single transaction"""
+        if not items:
+            return
+        now = time.time()
+        expires_at = self._expires_at(ttl)
+        rows = [(self.namespace, key, json.dumps(value), now, expires_at, now) for key, value in items.items()]
+
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for key, value in items.items():
+            self._remember(key, Entry(value, now, expires_at))
+        self._maybe_evict(len(rows))
+
+    def update(self, key, fn, ttl=None):
+        """Atomic read-modify-write across processes: store fn(current value or None)
+
+        If fn returns None the entry is left untouched.
+        """
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone()
+            value = fn(json.loads(row[0]) if row else None)
+            if value is not None:
+                now = time.time()
+                entry = Entry(value, now, self._expires_at(ttl))
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                             (self.namespace, key, json.dumps(value), now, entry.expires_at, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if value is not None:
+            self._remember(key, entry)
+            self._maybe_evict(1)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        _connect().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def clear(self):
+        """Drop every entry in this namespace from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        _connect().execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+
+    def lock(self, key, ttl):
+        """Try to take a cross-process lock on key for up to ttl seconds
+
+        Returns an owner token to pass to unlock(), or None if another holder
+        has it. Expired locks are taken over, so a crashed worker can't block
+        the key for longer than ttl.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT expires_at FROM locks WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone()
+            if row is not None and row[0] > now:
+                token = None
+            else:
+                conn.execute("INSERT OR REPLACE INTO locks VALUES (?, ?, ?, ?)",
+                             (self.namespace, key, token, now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return token
+
+    def unlock(self, key, token):
+        _connect().execute("DELETE FROM locks WHERE namespace = ? AND key = ? AND owner = ?",
+                           (self.namespace, key, token))
+
+    def _maybe_evict(self, writes):
+        self._writes += writes
+        if self._writes < EVICT_EVERY:
+            return
+        self._writes = 0
+        _connect().execute(
+            "DELETE FROM entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries))
+
+
+def get_cache(namespace, ttl=None, max_entries=10000):
+    """Process-wide Cache instance for a namespace"""
+    with _namespaces_lock:
+        if namespace not in _namespaces:
+            _namespaces[namespace] = Cache(namespace, ttl=ttl, max_entries=max_entries)
+        return _namespaces[namespace]
@@ -0,0 +1,103 @@
+from bisect import bisect_left, bisect_right
+import time
+
+# BirdEye interval names -> seconds
+INTERVAL_SECONDS = {
+    '1m': 60, '3m': 3 * 60, '5m': 5 * 60, '15m': 15 * 60, '30m': 30 * 60,
+    '1H': 3600, '2H': 2 * 3600, '4H': 4 * 3600, '6H': 6 * 3600, '8H': 8 * 3600, '12H': 12 * 3600,
+    '1D': 86400, '3D': 3 * 86400, '1W': 7 * 86400, '1M': 30 * 86400,
+}
+TAIL_TTL = 5 * 60  # how long a fetch of the still-open candles counts as covering them
+
+
+def interval_seconds(interval_type):
+    return INTERVAL_SECONDS.get(interval_type) or INTERVAL_SECONDS.get(interval_type.upper(), 3600)
+
+
+def merge_ranges(ranges):
+    """Union of closed [start, end] ranges, sorted and non-overlapping"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(covered, start, end):
+    """Parts of [start, end] not inside any of the merged `covered` ranges"""
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append([cursor, covered_start - 1])
+        cursor = max(cursor, covered_end + 1)
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append([cursor, end])
+    return gaps
+
+
+def empty():
+    return {'timestamps': [], 'values': [], 'covered': [], 'tail': None}
+
+
+def merge_points(store, timestamps, values):
+    """Merge new (timestamp, value) points into the store's sorted arrays"""
+    if not timestamps:
+        return
+    points = dict(zip(store['timestamps'], store['values']))
+    points.update(zip(timestamps, values))
+    ordered = sorted(points)
+    store['timestamps'] = ordered
+    store['values'] = [points[ts] for ts in ordered]
+
+
+def covered_ranges(store, now=None, tail_ttl=TAIL_TTL):
+    """Settled coverage plus the recently fetched open tail, if fetched within tail_ttl"""
+    now = now or time.time()
+    ranges = [list(r) for r in store['covered']]
+    tail = store.get('tail')
+    if tail and now - tail[2] <= tail_ttl:
+        ranges.append([tail[0], tail[1]])
+    return merge_ranges(ranges)
+
+
+def record_fetch(store, start, end, timestamps, values, interval, now=None):
+    """Add a fetched range to the store
+
+    Candles that may still change (within one interval of now) are not
+    marked as settled, only as a short-lived tail.
+    """
+    now = now or time.time()
+    merge_points(store, timestamps, values)
+    settled_end = min(end, int(now) - interval)
+    if settled_end >= start:
+        store['covered'] = merge_ranges(store['covered'] + [[start, settled_end]])
+    if end > settled_end:
+        store['tail'] = [max(start, settled_end + 1), end, now]
+
+
+def merge_stores(current, update):
+    """Combine two copies of a store (e.g. after a concurrent refresh)"""
+    merged = {
+        'timestamps': list(current['timestamps']),
+        'values': list(current['values']),
+        'covered': merge_ranges([list(r) for r in current['covered'] + update['covered']]),
+        'tail': max([t for t in (current.get('tail'), update.get('tail')) if t], key=lambda t: t[2], default=None),
+    }
+    merge_points(merged, update['timestamps'], update['values'])
+    return merged
+
+
+def window(store, start, end):
+    """Timestamps and values inside [start, end], located by binary search"""
+    lo = bisect_left(store['timestamps'], start)
+    hi = bisect_right(store['timestamps'], end)
+    return store['timestamps'][lo:hi], store['values'][lo:hi]
@@ -0,0 +1,60 @@
+"""Per-process clients created on first use
+
+Nothing connects at import time, so the app can be imported by the gunicorn
+master (e.g. with --preload) and forked safely. Each worker process builds its
+own Mongo pool and bot the first time they are needed; a client inherited
+through fork is never reused.
+
+This is also the one place .env is loaded, so entry points import clients
+before any module that reads its settings at import time.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+MONGO_URL = os.getenv('MONGO_URL')
+MONGO_TIMEOUT_MS = int(os.getenv('MongoTimeoutMs', '10000'))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _singleton(name, create):
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create()
+    return client
+
+
+def mongo():
+    """The process's MongoClient; every collection shares its connection pool"""
+    def create():
+        import pymongo
+        return pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+    return _singleton("mongo", create)
+
+
+def bot(configure=None):
+    """The process's TeleBot; configure(bot) runs once, when it is created"""
+    def create():
+        import telebot
+        # Handlers run inline on our own update workers, which keep per-chat order
+        instance = telebot.TeleBot(os.environ.get("TelegramBotToken"), threaded=False)
+        if configure:
+            configure(instance)
+        return instance
+    return _singleton("bot", create)
+
+
+def pool(name, workers):
+    """The process's thread pool called name, with `workers` threads"""
+    def create():
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return _singleton(f"pool:{name}", create)
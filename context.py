@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import database
+
+# Rough prompt budget for the conversation part of a Gemini request
+TOKEN_BUDGET = int(os.environ.get("ContextTokenBudget", "6000"))
+# When the window has to move, trim down to this share of the budget so it
+# stays put for the next few turns instead of moving (and re-summarizing) every time
+TRIM_RATIO = 0.75
+CHARS_PER_TOKEN = 4
+TRANSCRIPT_SNIPPET = 300
+
+
+def estimate_tokens(message):
+    """Cheap token estimate for one stored message"""
+    return len(json.dumps(message.get("parts", []), ensure_ascii=False)) // CHARS_PER_TOKEN + 4
+
+
+def fingerprint(message):
+    return hashlib.sha1(json.dumps(message, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def is_user_text(message):
+    return message.get("role") == "user" and any("text" in part for part in message.get("parts", []))
+
+
+def stub_function_responses(message):
+    """Replace full tool payloads in a function message with a short stub"""
+    if message.get("role") != "function":
+        return message
+    parts = []
+    for part in message.get("parts", []):
+        response = part.get("functionResponse")
+        if response is None:
+            parts.append(part)
+            continue
+        content = str(response.get("response", {}).get("content", ""))
+        parts.append({"functionResponse": {
+            "name": response["name"],
+            "response": {
+                "name": response["name"],
+                "content": f"[earlier {response['name']} result omitted, {len(content)} chars]"
+            }
+        }})
+    return {"role": "function", "parts": parts}
+
+
+def compact(messages):
+    """Stub every function response that precedes the latest user message"""
+    last_user = max((i for i, message in enumerate(messages) if is_user_text(message)), default=0)
+    return [stub_function_responses(message) if i < last_user else message
+            for i, message in enumerate(messages)]
+
+
+def window_start(messages, budget):
+    """Index of the oldest message that keeps the tail within budget
+
+    The window always starts on a user text message so tool call/response
+    pairs are never split.
+    """
+    total = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        total += estimate_tokens(messages[i])
+        if total > budget:
+            break
+        start = i
+    while start < len(messages) and not is_user_text(messages[start]):
+        start += 1
+    if start == len(messages):
+        # Even the latest turn is over budget, keep it whole
+        start = max((i for i, message in enumerate(messages) if is_user_text(message)), default=0)
+    return start
+
+
+def transcript(messages):
+    """Plain-text rendering of messages for the summarizer"""
+    lines = []
+    for message in messages:
+        for part in message.get("parts", []):
+            if "text" in part:
+                lines.append(f"{message['role']}: {part['text'][:TRANSCRIPT_SNIPPET]}")
+            elif "functionCall" in part:
+                call = part["functionCall"]
+                lines.append(f"model called {call['name']}({json.dumps(call.get('args', {}))})")
+            elif "functionResponse" in part:
+                content = str(part["functionResponse"].get("response", {}).get("content", ""))
+                lines.append(f"tool result: {content[:TRANSCRIPT_SNIPPET]}")
+    return "\n".join(lines)
+
+
+def build_contents(_id, messages, summarize, budget=TOKEN_BUDGET):
+    """Gemini `contents` for a conversation: a recent window plus a rolling summary
+
+    Turns that fall out of the window are folded into a summary kept on the
+    user document. The summary is recomputed only when the window boundary
+    moves, and then only over the turns that newly dropped out of it. The
+    boundary is stored by message number, so a repeated message can't be
+    mistaken for it.
+    `summarize(previous_summary, transcript)` returns the new summary text.
+    """
+    messages = compact(messages)
+    total = sum(estimate_tokens(message) for message in messages)
+    if total <= budget:
+        return messages
+
+    summary, first = database.get_summary(_id)
+    summary = summary or {}
+    # messages[i] is stored message number first + i. The fingerprint guards
+    # against a trim or reset having shifted the array since the summary
+    boundary = None
+    if summary.get("boundary_seq") is not None:
+        i = summary["boundary_seq"] - first
+        if 0 <= i < len(messages) and fingerprint(messages[i]) == summary.get("boundary"):
+            boundary = i
+
+    # Reuse the stored boundary while the window behind it still fits
+    if boundary is not None and sum(estimate_tokens(m) for m in messages[boundary:]) <= budget:
+        start = boundary
+    else:
+        start = window_start(messages, int(budget * TRIM_RATIO))
+        if start > 0 and start != boundary:
+            folded_from = boundary if boundary is not None and boundary < start else 0
+            print(f"Summarizing {start - folded_from} message(s) that left the context window")
+            try:
+                summary = {
+                    "text": summarize(summary.get("text", ""), transcript(messages[folded_from:start])),
+                    "boundary": fingerprint(messages[start]),
+                    "boundary_seq": first + start
+                }
+                database.set_summary(_id, summary)
+            except Exception as e:
+                # Answer with the old summary rather than failing the turn
+                print(f"Summary update failed: {e}")
+
+    window = messages[start:]
+    if start > 0 and summary.get("text"):
+        first = window[0]
+        window[0] = {"role": first["role"], "parts": [
+            {"text": f"(summary of our earlier conversation: {summary['text']})"}
+        ] + first["parts"]}
+    return window
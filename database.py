@@ -1,37 +1,117 @@
-from pymongo import MongoClient
+from pymongo import ReturnDocument
 import os
-from dotenv import load_dotenv
+import clients
+import metrics
 
 
-load_dotenv()
+def users():
+    """The users collection on this process's Mongo pool"""
+    return clients.mongo()['chat']['users']
 
-MONGO_URL = os.getenv('MONGO_URL')
-client = MongoClient(MONGO_URL)
-db = client['chat']
-Users = db['users']  
+# Keep only the newest N stored messages per user (0 keeps everything)
+MAX_MESSAGES = int(os.getenv('ConversationMaxMessages', '0'))
 
 instruction = "you are solana crypto trading assistant"
 
+@metrics.traced("mongo.reset_conversation")
 def reset_conversation(_id):
-    Users.update_one({"_id":_id},{"$set":{"conversation":[]}})
+    users().update_one({"_id":_id},{"$set":{"conversation":[]},"$unset":{"summary":""}})
 
+@metrics.traced("mongo.register")
 def register(_id): 
-    existance = Users.find_one({"_id":_id})
-    if existance == None:
-        Users.insert_one({"_id":_id,"conversation":[]})
-    
+    users().update_one({"_id":_id},{"$setOnInsert":{"conversation":[]}},upsert=True)
+
+def _push(messages):
+    push = {"$each": messages}
+    if MAX_MESSAGES:
+        push["$slice"] = -MAX_MESSAGES
+    # message_count numbers messages for history cursors and survives trimming
+    return {"$push": {"conversation": push}, "$inc": {"message_count": len(messages)}}
+
+@metrics.traced("mongo.add_message")
 def add_message(_id,message,role):
-    conversation = Users.find_one({"_id":_id}).get("conversation")
-    conversation.append({"role":role,"parts":message})
-    Users.update_one({"_id":_id},{"$set":{"conversation":conversation}})
-    return conversation
+    """Append one message atomically and return the updated conversation"""
+    user = users().find_one_and_update(
+        {"_id":_id},
+        _push([{"role":role,"parts":message}]),
+        projection={"_id":0,"conversation":1},
+        return_document=ReturnDocument.AFTER)
+    return user.get("conversation", []) if user else []
+
+@metrics.traced("mongo.add_messages")
+def add_messages(_id,messages):
+    """Append several {"role", "parts"} messages in one atomic update"""
+    if messages:
+        users().update_one({"_id":_id},_push(messages))
   
 
+@metrics.traced("mongo.set_user_info")
 def set_user_info(_id,info):
-    Users.update_one({"_id":_id},{"$set":info})
+    users().update_one({"_id":_id},{"$set":info})
+
+@metrics.traced("mongo.get_summary")
+def get_summary(_id):
+    """The stored summary and the number of the oldest stored message
+
+    Message numbers come from message_count (see _push); conversations
+    stored before it existed count from 0.
+    """
+    length = {"$size": {"$ifNull": ["$conversation", []]}}
+    user = next(users().aggregate([
+        {"$match": {"_id": _id}},
+        {"$project": {"_id": 0, "summary": 1, "first": {"$subtract": [
+            {"$max": [{"$ifNull": ["$message_count", 0]}, length]}, length]}}},
+    ]), None)
+    return (user.get("summary"), user["first"]) if user else (None, 0)
 
+@metrics.traced("mongo.set_summary")
+def set_summary(_id,summary):
+    users().update_one({"_id":_id},{"$set":{"summary":summary}})
+
+@metrics.traced("mongo.get_conversation")
 def get_conversation(_id):
-    user = Users.find_one({"_id": _id})
+    user = users().find_one({"_id": _id},{"_id":0,"conversation":1})
     return user.get("conversation", []) if user else []
 
-    
\ No newline at end of file
+
+# Stored messages scanned per requested history entry; a tool turn stores four
+HISTORY_SCAN = 4
+
+def _history_pipeline(_id, limit, before):
+    length = {"$size": {"$ifNull": ["$conversation", []]}}
+    # Conversations stored before message_count existed count from their length
+    total = {"$max": [{"$ifNull": ["$message_count", 0]}, length]}
+    end = "$length" if before is None else {"$min": ["$length", {"$max": [0, {"$subtract": [before, "$first"]}]}]}
+    texts = {"$map": {
+        "input": {"$filter": {"input": {"$ifNull": ["$$message.parts", []]}, "as": "part",
+                              "cond": {"$eq": [{"$type": "$$part.text"}, "string"]}}},
+        "as": "part", "in": "$$part.text"}}
+    window = {"$map": {"input": {"$range": ["$start", "$end"]}, "as": "i", "in": {
+        "$let": {"vars": {"message": {"$arrayElemAt": ["$conversation", "$$i"]}}, "in": {
+            "seq": {"$add": ["$first", "$$i"]}, "role": "$$message.role", "texts": texts}}}}}
+    return [
+        {"$match": {"_id": _id}},
+        {"$project": {"_id": 0, "conversation": 1, "length": length, "total": total}},
+        {"$addFields": {"first": {"$subtract": ["$total", "$length"]}}},
+        {"$addFields": {"end": end}},
+        {"$addFields": {"start": {"$max": [0, {"$subtract": ["$end", limit * HISTORY_SCAN]}]}}},
+        {"$project": {
+            "total": 1, "first": 1, "start": {"$add": ["$first", "$start"]},
+            "messages": {"$slice": [{"$filter": {"input": window, "cond": {"$and": [
+                {"$in": ["$$this.role", ["user", "model"]]},
+                {"$gt": [{"$size": "$$this.texts"}, 0]}]}}}, -limit]},
+        }},
+    ]
+
+@metrics.traced("mongo.get_history")
+def get_history(_id,limit,before=None):
+    """One page of user and model text ending before message number `before`
+
+    Slicing and projection run in Mongo: only a window of limit * HISTORY_SCAN
+    stored messages is looked at and only their text parts come back, so a
+    page costs the same however long the chat is. Returns total (number of the
+    next message), first (number of the oldest stored one), start (where the
+    scanned window began) and messages [{seq, role, texts}] oldest first, or
+    None for an unknown user.
+    """
+    return next(users().aggregate(_history_pipeline(_id, limit, before)), None)
@@ -0,0 +1,136 @@
+"""Prebuilt generateContent request envelope
+
+The static part of every chat request (persona, tool declarations, safety
+settings, generation config) is serialized once per process; each request
+only serializes its contents. With GeminiContextCache=1 the system
+instruction and tools are uploaded once through the cachedContents API and
+referenced by handle, renewed before the handle expires. Any failure there
+falls back to sending the prefix inline.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from cache import get_cache
+import http_client
+import metrics
+import singleflight
+
+CONTEXT_CACHE = os.environ.get("GeminiContextCache", "0") == "1"
+CONTEXT_CACHE_TTL = int(os.environ.get("GeminiContextCacheTtl", str(60 * 60)))
+RENEW_MARGIN = 5 * 60  # renew a handle this long before it expires
+RETRY_AFTER = 10 * 60  # wait this long after a failed upload before trying again
+
+# Fields a cachedContents handle replaces in the request
+CACHEABLE_FIELDS = ("system_instruction", "tools")
+
+# Handles are shared by all workers through the cache store
+handle_cache = get_cache("gemini_context", ttl=CONTEXT_CACHE_TTL, max_entries=100)
+
+CONTEXT_CACHE_EVENTS = metrics.counter("gemini_context_cache_total",
+                                       "cachedContents handle uploads, renewals and fallbacks", ["event"])
+
+
+def fragment(fields):
+    """A dict serialized without its braces, for splicing into a request body"""
+    return json.dumps(fields, separators=(",", ":"), ensure_ascii=False)[1:-1]
+
+
+def parse_expire_time(value):
+    # RFC 3339 with up to nanosecond precision, e.g. 2025-01-30T12:00:00.123456789Z
+    value = value.rstrip("Z").split(".")[0]
+    return datetime.fromisoformat(value + "+00:00").timestamp()
+
+
+class Request(dict):
+    """A chat request dict that remembers the template it was built from"""
+
+    def __init__(self, template, contents):
+        super().__init__(contents=contents, **template.static)
+        self.template = template
+
+
+class Template:
+
+    def __init__(self, static, model, api_url, api_key):
+        self.static = static
+        self.model = model
+        self.api_url = api_url
+        self.api_key = api_key
+        self.inline = fragment(static)
+        self.digest = hashlib.sha256(self.inline.encode()).hexdigest()
+        self._handle_fragments = {}
+        self._disabled_until = 0
+
+    def build(self, contents):
+        return Request(self, contents)
+
+    def serialize(self, request, use_cache=True):
+        """Request body as JSON, and the cachedContents handle it references (or None)"""
+        contents = json.dumps(request["contents"], separators=(",", ":"), ensure_ascii=False)
+        handle = self.handle() if use_cache else None
+        if handle is None:
+            return '{"contents":' + contents + "," + self.inline + "}", None
+        prefix = self._handle_fragments.get(handle)
+        if prefix is None:
+            rest = {key: value for key, value in self.static.items() if key not in CACHEABLE_FIELDS}
+            prefix = self._handle_fragments[handle] = fragment({"cachedContent": handle, **rest})
+        return '{"contents":' + contents + "," + prefix + "}", handle
+
+    def handle(self):
+        """Name of a live cachedContents handle for the static prefix, or None"""
+        if not CONTEXT_CACHE or time.time() < self._disabled_until:
+            return None
+        stored = handle_cache.get(self.digest)
+        if stored and stored["expires_at"] - time.time() > RENEW_MARGIN:
+            return stored["name"]
+        try:
+            stored = singleflight.do(handle_cache, self.digest, lambda: self._refresh(stored),
+                                     recheck=self._live_handle)
+        except Exception as e:
+            print(f"Gemini context cache unavailable, sending the prompt inline: {e}")
+            CONTEXT_CACHE_EVENTS.inc(event="fallback")
+            self._disabled_until = time.time() + RETRY_AFTER
+            return None
+        return stored["name"]
+
+    def _live_handle(self):
+        stored = handle_cache.get_entry(self.digest, shared=True)
+        if stored and stored.value["expires_at"] - time.time() > RENEW_MARGIN:
+            return stored.value
+        return None
+
+    def _refresh(self, stored):
+        """Extend the current handle's TTL, or upload the prefix as a new one"""
+        key = f"key={self.api_key}"
+        ttl = {"ttl": f"{CONTEXT_CACHE_TTL}s"}
+        response = None
+        if stored:
+            response = http_client.request(
+                "PATCH", f"{self.api_url}/v1beta/{stored['name']}?updateMask=ttl&{key}", json=ttl)
+            CONTEXT_CACHE_EVENTS.inc(event="renew" if response.status_code == 200 else "renew_failed")
+        if response is None or response.status_code != 200:
+            body = {
+                "model": f"models/{self.model}",
+                "systemInstruction": self.static["system_instruction"],
+                "tools": self.static["tools"],
+                **ttl,
+            }
+            response = http_client.post(f"{self.api_url}/v1beta/cachedContents?{key}", json=body)
+            if response.status_code != 200:
+                raise Exception(f"cachedContents upload failed: {response.status_code} - {response.text}")
+            CONTEXT_CACHE_EVENTS.inc(event="upload")
+
+        data = response.json()
+        stored = {"name": data["name"], "expires_at": parse_expire_time(data["expireTime"])}
+        handle_cache.set(self.digest, stored, ttl=max(int(stored["expires_at"] - time.time()), 1))
+        return stored
+
+    def invalidate(self, handle):
+        """Forget a handle Gemini rejected; the next request uploads a new one"""
+        CONTEXT_CACHE_EVENTS.inc(event="rejected")
+        stored = handle_cache.get(self.digest)
+        if stored and stored["name"] == handle:
+            handle_cache.delete(self.digest)
+        self._handle_fragments.pop(handle, None)
@@ -0,0 +1,145 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+CONNECT_TIMEOUT = float(os.environ.get("HttpConnectTimeout", "5"))
+READ_TIMEOUT = float(os.environ.get("HttpReadTimeout", "60"))
+MAX_RETRIES = int(os.environ.get("HttpMaxRetries", "3"))
+BACKOFF_BASE = 0.5  # seconds, doubled on every attempt
+BACKOFF_MAX = 20
+POOL_SIZE = 20
+# Requests per second allowed per host and process, e.g. "api.helius.xyz=10,public-api.birdeye.so=1"
+RATE_LIMITS = {
+    host.strip(): float(rate)
+    for host, _, rate in (item.partition("=") for item in os.environ.get("HttpRateLimits", "").split(","))
+    if host.strip() and rate
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_buckets = {}
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available; returns the seconds waited"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is this caller's place in the queue
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+def get_bucket(host):
+    """The host's rate limiter in this process, or None when it is not limited"""
+    rate = RATE_LIMITS.get(host)
+    if not rate:
+        return None
+    key = (os.getpid(), host)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _sessions_lock:
+            bucket = _buckets.setdefault(key, TokenBucket(rate))
+    return bucket
+
+
+def get_session(url):
+    """Keep-alive session for the url's host, one pool per host and process"""
+    key = (os.getpid(), urlsplit(url).netloc)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def backoff_delay(attempt, response=None):
+    """Seconds to wait before retry number `attempt` (0-based)
+
+    Honors a Retry-After header when the server sent one, otherwise uses
+    exponential backoff with full jitter.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after)
+                return min(max((when - datetime.now(timezone.utc)).total_seconds(), 0), BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, retries=MAX_RETRIES, timeout=None, **kwargs):
+    """Send a request through the pooled session, retrying transient failures
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    `retries` times, and every attempt first waits for the host's rate
+    limit. The last response is returned whatever its status, so callers
+    keep their own status handling.
+    """
+    session = get_session(url)
+    bucket = get_bucket(urlsplit(url).netloc)
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    attempt = 0
+    while True:
+        if bucket is not None:
+            waited = bucket.acquire()
+            if waited:
+                metrics.HTTP_THROTTLED.observe(waited, host=urlsplit(url).netloc)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            metrics.HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=type(e).__name__)
+            print(f"{method} {urlsplit(url).netloc} failed: {e}, retrying in {delay:.1f}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+            delay = backoff_delay(attempt, response)
+            metrics.HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=response.status_code)
+            print(f"{method} {urlsplit(url).netloc} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,165 @@
+"""In-process metrics and request-scoped timing spans
+
+Counters and histograms are rendered in the Prometheus text format by
+`render()`. Every gunicorn worker keeps its own registry, so scrape each
+worker or aggregate in Prometheus. Spans log their duration together with the
+current request ID when SpanLogging is enabled.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LOG_SPANS = os.environ.get("SpanLogging", "1") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_registry = []
+
+
+def new_request_id(value=None):
+    """Start a new request scope; returns its ID"""
+    value = value or uuid.uuid4().hex[:12]
+    _request_id.set(value)
+    return value
+
+
+def request_id():
+    return _request_id.get()
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # per-bucket counts, sum, count
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+def counter(name, help, labelnames=()):
+    metric = Counter(name, help, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, help, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+SPAN_SECONDS = histogram("span_duration_seconds", "Time spent in an instrumented stage", ["span"])
+HTTP_SECONDS = histogram("http_request_duration_seconds", "Flask request latency", ["endpoint", "status"])
+TOOL_CALLS = counter("tool_calls_total", "Gemini function calls executed", ["tool"])
+GEMINI_RETRIES = counter("gemini_retries_total", "Gemini requests retried on an empty answer")
+HTTP_RETRIES = counter("http_retries_total", "Outbound requests retried by http_client", ["host", "reason"])
+HTTP_THROTTLED = histogram("http_throttle_seconds", "Time outbound requests waited on a host's rate limit", ["host"])
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by outcome", ["cache", "result"])
+PAYLOAD_BYTES = histogram("payload_bytes", "Size of payloads sent to Gemini and returned by tools", ["kind"],
+                          buckets=SIZE_BUCKETS)
+
+
+@contextmanager
+def span(name):
+    """Time a block, record it in span_duration_seconds and log it with the request ID"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, span=name)
+        if LOG_SPANS:
+            print(f"[{request_id()}] {name} {elapsed * 1000:.1f}ms")
+
+
+def traced(name):
+    """Decorator form of span(); generator functions are timed while consumed"""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with span(name):
+                    yield from fn(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_result(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
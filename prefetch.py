@@ -0,0 +1,129 @@
+"""Speculative tool prefetch for Solana addresses found in a user message
+
+While the first Gemini call is in flight, addresses in the message are
+looked up in the background: token mints warm the coin cache, wallets start
+get_transactions. Mints already in the token registry or coin cache are told
+apart without a network call; for any other address the coin lookup and the
+wallet sync start side by side, and the sync stops once the lookup finds a
+token. When the model then calls a tool for the same address it joins the
+running fetch (see singleflight) or finds a warm cache. Prefetches run on a
+small per-process pool and are cancelled once the answer is done; a wallet
+sync nobody waits on stops at its next page.
+"""
+import contextvars
+import os
+import re
+import threading
+import clients
+import metrics
+import token_registry
+from analyze_transactions import coin_cache, get_coin_data, get_transactions, SyncCancelled
+
+ENABLED = os.environ.get("Prefetch", "1") == "1"
+WORKERS = int(os.environ.get("PrefetchWorkers", "4"))
+MAX_ADDRESSES = 3  # per message
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+CANDIDATE_PATTERN = re.compile(r"\b[1-9A-HJ-NP-Za-km-z]{32,44}\b")
+
+PREFETCHES = metrics.counter("prefetch_total", "Speculative address lookups by outcome", ["result"])
+
+def base58_decode(text):
+    number = 0
+    for char in text:
+        number = number * 58 + BASE58_ALPHABET.index(char)
+    leading_zeros = len(text) - len(text.lstrip("1"))
+    return b"\0" * leading_zeros + number.to_bytes((number.bit_length() + 7) // 8, "big")
+
+
+def is_solana_address(text):
+    """A base58 string that decodes to a 32-byte public key"""
+    try:
+        return len(base58_decode(text)) == 32
+    except ValueError:
+        return False
+
+
+def find_addresses(text):
+    """Distinct Solana addresses in text, in order of appearance"""
+    addresses = []
+    for candidate in CANDIDATE_PATTERN.findall(text or ""):
+        if candidate not in addresses and is_solana_address(candidate):
+            addresses.append(candidate)
+            if len(addresses) == MAX_ADDRESSES:
+                break
+    return addresses
+
+
+class Prefetch:
+    """Handle on the lookups started for one message"""
+
+    def __init__(self, addresses=()):
+        self.addresses = list(addresses)
+        self.futures = []
+        self._cancelled = threading.Event()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Drop lookups that haven't started and stop unused wallet syncs"""
+        self._cancelled.set()
+        for future in self.futures:
+            if future.cancel():
+                PREFETCHES.inc(result="cancelled")
+
+
+def known_token(address):
+    """Whether the address is a mint we have seen, without asking Helius"""
+    if token_registry.get_token(address):
+        return True
+    entry = coin_cache.get_entry(f"solana-{address}")
+    return bool(entry and entry.value and entry.value.get("symbol"))
+
+
+def lookup(address, job, is_token):
+    if job.cancelled():
+        return
+    try:
+        coin = get_coin_data(address)
+        if coin and coin.get("symbol"):
+            # A token mint, its metadata is cached now
+            is_token.set()
+            PREFETCHES.inc(result="token")
+    except Exception as e:
+        print(f"Prefetch of {address} failed: {e}")
+        PREFETCHES.inc(result="error")
+
+
+def sync(address, job, is_token):
+    if job.cancelled() or is_token.is_set():
+        return
+    try:
+        get_transactions(address, cancelled=lambda: job.cancelled() or is_token.is_set())
+        if not is_token.is_set():
+            PREFETCHES.inc(result="wallet")
+    except SyncCancelled as e:
+        print(f"Prefetch stopped: {e}")
+        PREFETCHES.inc(result="cancelled")
+    except Exception as e:
+        print(f"Prefetch of {address} failed: {e}")
+        PREFETCHES.inc(result="error")
+
+
+def start(text):
+    """Start background lookups for the addresses in a message; cancel() the result when done"""
+    job = Prefetch(find_addresses(text) if ENABLED else ())
+    tasks = []
+    syncs = []
+    for address in job.addresses:
+        is_token = threading.Event()
+        tasks.append((lookup, address, is_token))
+        if not known_token(address):
+            syncs.append((sync, address, is_token))
+    # Lookups are single calls, queue them ahead of the syncs
+    for task, address, is_token in tasks + syncs:
+        # Keep the request ID on the prefetch's spans
+        context = contextvars.copy_context()
+        job.futures.append(clients.pool("prefetch", WORKERS).submit(context.run, task, address, job, is_token))
+    return job
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def lttb(timestamps, values, target):
+    """Largest-Triangle-Three-Buckets downsampling to at most `target` points
+
+    Keeps the first and last point and, for every bucket in between, the
+    point that forms the largest triangle with its neighbours, which
+    preserves peaks and dips far better than plain striding.
+    """
+    x = np.asarray(timestamps, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    n = len(x)
+    if target >= n or target < 3:
+        return np.asarray(timestamps), y
+
+    edges = np.linspace(1, n - 1, target - 1).astype(np.int64)
+    keep = np.empty(target, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    previous = 0
+    for bucket in range(target - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (or the last point) as the third vertex
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        area = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        keep[bucket + 1] = previous
+    return np.asarray(timestamps)[keep], y[keep]
+
+
+def ohlc(timestamps, values, target):
+    """Bucket a series into `target` equal-count OHLC bars keyed by bucket start"""
+    ts = np.asarray(timestamps)
+    y = np.asarray(values, dtype=np.float64)
+    n = len(y)
+    target = max(1, min(target, n))
+    starts = np.linspace(0, n, target + 1).astype(np.int64)[:-1]
+    ends = np.append(starts[1:], n)
+    return {
+        'timestamps': ts[starts],
+        'open': y[starts],
+        'high': np.maximum.reduceat(y, starts),
+        'low': np.minimum.reduceat(y, starts),
+        'close': y[ends - 1],
+    }
+
+
+def stats(values):
+    """Summary numbers for a price series; volatility is the stdev of log returns in %"""
+    y = np.asarray(values, dtype=np.float64)
+    positive = y[y > 0]
+    returns = np.diff(np.log(positive)) if len(positive) > 1 else np.array([])
+    return {
+        'first': float(y[0]),
+        'last': float(y[-1]),
+        'min': float(y.min()),
+        'max': float(y.max()),
+        'change_pct': float((y[-1] / y[0] - 1) * 100) if y[0] else None,
+        'volatility_pct': float(returns.std() * 100) if len(returns) else None,
+    }
@@ -0,0 +1,102 @@
+"""Cache of Gemini responses keyed on the normalized request
+
+The key covers everything that shapes the answer: system instruction, tool
+declarations, generation settings and the trimmed context window including
+tool results. User text is case-folded and whitespace-collapsed, so "gm" and
+"GM " share an entry. With ResponseCacheScope=user, windows that hold tool
+calls or results are only reused within one conversation, while tool-free
+windows are shared across users, so a greeting or question that opens many
+chats is answered once. With global every entry is shared, and off disables
+the cache.
+"""
+import copy
+import hashlib
+import json
+import os
+from cache import get_cache
+import candle_store
+import metrics
+from analyze_transactions import TRANSACTIONS_TTL
+
+SCOPE = os.environ.get("ResponseCacheScope", "user")
+TTL = int(os.environ.get("ResponseCacheTtl", str(60 * 60)))  # turns without tool results
+# An answer built on a tool result is only as fresh as that tool's data
+TOOL_TTLS = {
+    "get_user_trades": int(TRANSACTIONS_TTL.total_seconds()),
+    "get_wallet_pnl": int(TRANSACTIONS_TTL.total_seconds()),
+    "get_token_details": candle_store.TAIL_TTL,
+}
+
+response_cache = get_cache("gemini_responses", ttl=TTL, max_entries=20000)
+
+SAVED_TOKENS = metrics.counter("gemini_cached_tokens_total", "Gemini tokens not spent thanks to cached responses")
+
+
+def normalize_text(text):
+    return " ".join(text.split()).casefold()
+
+
+def normalize(data):
+    """Copy of a request with user text normalized for hashing"""
+    data = copy.deepcopy(data)
+    for message in data.get("contents", []):
+        if message.get("role") != "user":
+            continue
+        for part in message.get("parts", []):
+            if "text" in part:
+                part["text"] = normalize_text(part["text"])
+    return data
+
+
+def uses_tools(contents):
+    """Whether any message in the window is a tool call or result"""
+    return any("functionCall" in part or "functionResponse" in part
+               for message in contents for part in message.get("parts", []))
+
+
+def request_key(data, scope_id=None):
+    """Cache key for a request, or None when caching is off for it"""
+    private = SCOPE == "user" and uses_tools(data.get("contents", []))
+    if SCOPE == "off" or (private and scope_id is None):
+        return None
+    template = getattr(data, "template", None)
+    if template is not None:
+        # The static prefix is already hashed once per process
+        payload = template.digest + json.dumps(normalize({"contents": data["contents"]}), sort_keys=True,
+                                               separators=(",", ":"), ensure_ascii=False)
+    else:
+        payload = json.dumps(normalize(data), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    scope = str(scope_id) if private else "*"
+    return hashlib.sha256(f"{scope}\n{payload}".encode()).hexdigest()
+
+
+def ttl_for(data):
+    """Shortest freshness of any tool result in the request, else the default TTL"""
+    ttl = TTL
+    for message in data.get("contents", []):
+        for part in message.get("parts", []):
+            name = part.get("functionResponse", {}).get("name")
+            if name:
+                ttl = min(ttl, TOOL_TTLS.get(name, TTL))
+    return ttl
+
+
+def cacheable(response_data):
+    """Only complete answers with content are worth replaying"""
+    candidates = (response_data or {}).get("candidates") or []
+    return bool(candidates and candidates[0].get("content", {}).get("parts"))
+
+
+def get(key):
+    if key is None:
+        return None
+    response_data = response_cache.get(key)
+    metrics.cache_result("gemini_responses", response_data is not None)
+    if response_data is not None:
+        SAVED_TOKENS.inc(response_data.get("usageMetadata", {}).get("totalTokenCount", 0))
+    return response_data
+
+
+def put(key, data, response_data):
+    if key is not None and cacheable(response_data):
+        response_cache.set(key, response_data, ttl=ttl_for(data))
@@ -0,0 +1,128 @@
+"""Request coalescing for cache misses
+
+Concurrent callers asking for the same key in one process share a single
+in-flight fetch. Between gunicorn workers a lock in the shared cache keeps a
+second worker from fetching the same key; it polls the cache for the
+leader's result instead.
+"""
+import contextvars
+import os
+import threading
+import time
+import metrics
+
+LOCK_TTL = float(os.environ.get("SingleFlightLockTtl", "60"))
+POLL_INTERVAL = 0.1
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+COALESCED = metrics.counter("singleflight_coalesced_total",
+                            "Callers that waited on another caller's fetch", ["cache", "scope"])
+REFRESHES = metrics.counter("singleflight_refreshes_total",
+                            "Background refreshes of stale entries", ["cache"])
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.skipped = False  # a wait=False leader found another worker's lock
+
+
+# Returned by _run when it did not wait on another worker's lock
+SKIPPED = object()
+
+
+def _run(cache, key, fn, recheck, lock_ttl, wait):
+    token = cache.lock(key, lock_ttl)
+    if token is None:
+        if not wait:
+            return SKIPPED
+        # Another worker is fetching this key, wait for it to land in the cache
+        COALESCED.inc(cache=cache.namespace, scope="worker")
+        deadline = time.monotonic() + lock_ttl
+        while token is None and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = recheck() if recheck else None
+            if value is not None:
+                return value
+            token = cache.lock(key, lock_ttl)
+        if token is None:
+            print(f"Gave up waiting for {cache.namespace}:{key}, fetching it here")
+
+    try:
+        # The previous holder may have finished between our miss and the lock
+        value = recheck() if recheck and token else None
+        return value if value is not None else fn()
+    finally:
+        if token:
+            cache.unlock(key, token)
+
+
+def do(cache, key, fn, recheck=None, lock_ttl=LOCK_TTL, wait=True):
+    """Return fn(), running it only once for concurrent callers of the same key
+
+    recheck() should return the value if it is now in the cache, else None; it
+    lets a caller pick up a fetch finished by another worker. With wait=False
+    the call returns None instead of waiting on another worker's lock;
+    callers that joined such a call run the fetch themselves.
+    """
+    flight_key = (cache.namespace, key)
+    with _flights_lock:
+        flight = _flights.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[flight_key] = Flight()
+        else:
+            flight.waiters += 1
+
+    if not leader:
+        COALESCED.inc(cache=cache.namespace, scope="process")
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        if flight.skipped:
+            # The leader only refreshes in the background, fetch with our own settings
+            return do(cache, key, fn, recheck, lock_ttl, wait)
+        return flight.result
+
+    try:
+        result = _run(cache, key, fn, recheck, lock_ttl, wait)
+        flight.skipped = result is SKIPPED
+        flight.result = None if flight.skipped else result
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(flight_key, None)
+        flight.done.set()
+
+
+def waiting(cache, key):
+    """Whether other callers in this process are waiting on the key's fetch"""
+    with _flights_lock:
+        flight = _flights.get((cache.namespace, key))
+        return flight is not None and flight.waiters > 0
+
+
+def refresh(cache, key, fn, lock_ttl=LOCK_TTL):
+    """Refresh a stale key in the background unless a fetch is already running"""
+    with _flights_lock:
+        if (cache.namespace, key) in _flights:
+            return
+
+    def run():
+        try:
+            do(cache, key, fn, lock_ttl=lock_ttl, wait=False)
+        except Exception as e:
+            print(f"Background refresh of {cache.namespace}:{key} failed: {e}")
+
+    REFRESHES.inc(cache=cache.namespace)
+    # Carry the request ID over so the refresh's spans are attributed
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
@@ -0,0 +1,215 @@
+"""Columnar on-disk store of a wallet's swap legs
+
+Each wallet gets a directory of flat column files with one row per non-SOL
+token leg (see analytics.swap_arrays), ordered by time:
+
+    timestamp  int64    block time
+    swap       int32    position of the swap in `signature`
+    mint       int32    index into the meta's tokens
+    amount     float64  signed token amount (+ bought, - sold)
+    sol        float64  SOL moved against the leg, NaN when none
+    source     int16    index into the meta's sources
+
+Syncs append rows for new swaps only. meta.json is replaced last and holds
+the committed row count, so readers never see half of an append. Readers open
+the columns with numpy.memmap and slice by time with a binary search; nothing
+is parsed or copied. When the store falls out of step with the cached sync
+state it is rewritten into a new generation directory.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import numpy as np
+import analytics
+import metrics
+
+STORE_DIR = os.environ.get("SwapStoreDir", "swap_store")
+
+ROW_COLUMNS = {
+    'timestamp': np.int64,
+    'swap': np.int32,
+    'mint': np.int32,
+    'amount': np.float64,
+    'sol': np.float64,
+    'source': np.int16,
+}
+SIGNATURE_DTYPE = np.dtype('S88')  # base58 signatures are at most 88 characters
+ADDRESS_PATTERN = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{32,44}$")
+
+WRITES = metrics.counter("swap_store_writes_total", "Swap store writes by kind", ["kind"])
+
+
+def wallet_dir(wallet_address):
+    # Addresses are base58 and safe as file names; hash anything else
+    name = wallet_address if ADDRESS_PATTERN.match(wallet_address or "") else \
+        hashlib.sha256((wallet_address or "").encode()).hexdigest()
+    return os.path.join(STORE_DIR, name)
+
+
+def empty_meta():
+    return {'generation': 0, 'rows': 0, 'swaps': 0, 'newest_signature': None, 'tokens': [], 'sources': []}
+
+
+class WalletStore:
+    """One wallet's columns as of the last committed write"""
+
+    def __init__(self, wallet_address):
+        self.wallet_address = wallet_address
+        self.path = wallet_dir(wallet_address)
+        self._load_meta()
+
+    def _load_meta(self):
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = empty_meta()
+        self.mint_ids = {token['address']: i for i, token in enumerate(self.meta['tokens'])}
+
+    @property
+    def newest_signature(self):
+        return self.meta['newest_signature']
+
+    @property
+    def swap_count(self):
+        return self.meta['swaps']
+
+    def _file(self, name, generation=None):
+        generation = self.meta['generation'] if generation is None else generation
+        return os.path.join(self.path, f"g{generation}", name)
+
+    def _column(self, name, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=(length,))
+
+    def columns(self, start=None, end=None, mints=None):
+        """Rows with start <= timestamp <= end, optionally only for the given mints
+
+        Returns the analytics.swap_arrays layout with the store's token list.
+        A time slice is a view into the mapped files; a mint filter copies just
+        the matching rows.
+        """
+        rows = self.meta['rows']
+        data = {name: self._column(name, dtype, rows) for name, dtype in ROW_COLUMNS.items()}
+        lo = 0 if start is None else int(np.searchsorted(data['timestamp'], start, side='left'))
+        hi = rows if end is None else int(np.searchsorted(data['timestamp'], end, side='right'))
+        data = {name: column[lo:hi] for name, column in data.items()}
+        if mints is not None:
+            ids = [self.mint_ids[mint] for mint in mints if mint in self.mint_ids]
+            keep = np.isin(data['mint'], ids)
+            data = {name: column[keep] for name, column in data.items()}
+        data['tokens'] = self.meta['tokens']
+        return data
+
+    def signatures(self, swap_ids):
+        """Transaction signatures of the given swap positions"""
+        column = self._column("signature", SIGNATURE_DTYPE, self.meta['swaps'])
+        return [signature.decode() for signature in column[np.asarray(swap_ids, dtype=np.int64)]]
+
+    def record(self, stored, new_swaps=None, previous_signature=None):
+        """Bring the files in line with a wallet's cached sync state
+
+        `new_swaps` (newest first) are the swaps synced after
+        `previous_signature`; they are appended when the store is at that
+        signature. Otherwise the store is rebuilt from stored['filtered_data'].
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have written since this store was opened
+            self._load_meta()
+            newest = stored.get('newest_signature')
+            if self.meta['newest_signature'] == newest and os.path.exists(os.path.join(self.path, "meta.json")):
+                return
+            if (new_swaps is not None and previous_signature
+                    and self.meta['newest_signature'] == previous_signature
+                    and self._appendable(new_swaps)):
+                self._write(new_swaps, newest, reset=False)
+                WRITES.inc(kind="append")
+            else:
+                self._write(stored.get('filtered_data') or [], newest, reset=True)
+                WRITES.inc(kind="rebuild")
+
+    def _appendable(self, swaps):
+        # Rows must stay in time order for the binary search
+        if not swaps or self.meta['rows'] == 0:
+            return True
+        last = self._column("timestamp", np.int64, self.meta['rows'])[-1]
+        return min(swap['timestamp'] for swap in swaps) >= last
+
+    def _write(self, swaps, newest_signature, reset):
+        meta = empty_meta() if reset else json.loads(json.dumps(self.meta))
+        if reset:
+            meta['generation'] = self.meta['generation'] + 1
+        swaps = swaps[::-1]  # oldest first
+        batch = analytics.swap_arrays(swaps)
+        order = np.argsort(batch['timestamp'], kind='stable')
+
+        mint_ids = {} if reset else dict(self.mint_ids)
+        for token in batch['tokens']:
+            entry = {key: token.get(key) for key in ('address', 'symbol', 'name', 'current_price')}
+            if token['address'] in mint_ids:
+                # Keep the latest symbol and price we have seen
+                meta['tokens'][mint_ids[token['address']]] = entry
+            else:
+                mint_ids[token['address']] = len(meta['tokens'])
+                meta['tokens'].append(entry)
+        token_map = np.array([mint_ids[token['address']] for token in batch['tokens']], dtype=np.int32)
+
+        source_ids = {source: i for i, source in enumerate(meta['sources'])}
+        swap_sources = []
+        for swap in swaps:
+            source = swap.get('source') or 'Unknown'
+            if source not in source_ids:
+                source_ids[source] = len(meta['sources'])
+                meta['sources'].append(source)
+            swap_sources.append(source_ids[source])
+        swap_sources = np.array(swap_sources, dtype=np.int16)
+
+        local_swaps = batch['swap'][order]
+        rows = {
+            'timestamp': batch['timestamp'][order],
+            'swap': local_swaps + meta['swaps'],
+            'mint': token_map[batch['mint'][order]] if len(token_map) else np.empty(0, dtype=np.int32),
+            'amount': batch['amount'][order],
+            'sol': batch['sol'][order],
+            'source': swap_sources[local_swaps] if len(swap_sources) else np.empty(0, dtype=np.int16),
+        }
+        signatures = np.array([swap.get('signature') or '' for swap in swaps], dtype=SIGNATURE_DTYPE)
+
+        os.makedirs(os.path.dirname(self._file("meta", meta['generation'])), exist_ok=True)
+        for name, dtype in ROW_COLUMNS.items():
+            self._append_file(self._file(name, meta['generation']), rows[name].astype(dtype),
+                              meta['rows'] * np.dtype(dtype).itemsize)
+        self._append_file(self._file("signature", meta['generation']), signatures,
+                          meta['swaps'] * SIGNATURE_DTYPE.itemsize)
+
+        meta['rows'] += len(rows['timestamp'])
+        meta['swaps'] += len(swaps)
+        meta['newest_signature'] = newest_signature
+        temp_path = os.path.join(self.path, f"meta.json.{os.getpid()}")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(self.path, "meta.json"))
+
+        previous_generation = self.meta['generation']
+        self.meta = meta
+        self.mint_ids = mint_ids
+        if reset:
+            # Readers may still be opening the previous generation, drop the one before it
+            shutil.rmtree(os.path.join(self.path, f"g{previous_generation - 1}"), ignore_errors=True)
+
+    @staticmethod
+    def _append_file(path, array, committed_bytes):
+        with open(path, "ab") as f:
+            # Drop whatever an interrupted write left past the committed rows
+            f.truncate(committed_bytes)
+            f.write(array.tobytes())
+
+
+def open_store(wallet_address):
+    return WalletStore(wallet_address)
@@ -0,0 +1,225 @@
+"""Render the model's Markdown as Telegram HTML, split into sendable messages
+
+Only tags Telegram accepts are produced (b, i, s, code, pre, a, blockquote),
+everything else is escaped. Each source line is rendered once with
+precompiled patterns and appended straight to the current message, so cost
+grows linearly with the answer. Messages are split between lines; a code
+block or quote cut by a split is closed and reopened in the next message.
+Only a line too long for a message of its own is cut inside, after it is
+rendered, with its open tags closed and reopened around the cut.
+"""
+import html
+import re
+
+MAX_LENGTH = 4096  # Telegram's limit for one message
+
+FENCE = re.compile(r"^\s*```\s*([\w+-]*)\s*$")
+HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+QUOTE = re.compile(r"^\s{0,3}>\s?(.*)$")
+RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+INLINE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<bold>\S(?:.*?\S)?)\*\*"
+    r"|(?<!\w)__(?P<bold_u>\S(?:.*?\S)?)__(?!\w)"
+    r"|~~(?P<strike>\S(?:.*?\S)?)~~"
+    r"|\[(?P<label>[^\]\n]+)\]\((?P<url>[^)\s]+)\)"
+    r"|(?<![\w*])\*(?P<italic>[^*\s](?:[^*\n]*?[^*\s])?)\*(?![\w*])"
+    r"|(?<!\w)_(?P<italic_u>[^_\s](?:[^_\n]*?[^_\s])?)_(?!\w)"
+)
+TAG = re.compile(r"<[^>]+>")
+# Rendered HTML as tags, entities and text runs
+HTML_TOKEN = re.compile(r"<(/?)(\w+)[^>]*>|&#?\w+;|[^<&]+")
+ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+WRAPPERS = {"bold": "b", "bold_u": "b", "strike": "s", "italic": "i", "italic_u": "i"}
+
+
+def escape(text):
+    return text.translate(ESCAPES)
+
+
+def inline(text):
+    """Inline Markdown of one line as Telegram HTML"""
+    out = []
+    position = 0
+    for match in INLINE.finditer(text):
+        out.append(escape(text[position:match.start()]))
+        kind = match.lastgroup
+        if kind == "code":
+            out.append(f"<code>{escape(match.group('code'))}</code>")
+        elif kind == "url":
+            url = html.escape(match.group("url"), quote=True)
+            out.append(f'<a href="{url}">{inline(match.group("label"))}</a>')
+        else:
+            tag = WRAPPERS[kind]
+            out.append(f"<{tag}>{inline(match.group(kind))}</{tag}>")
+        position = match.end()
+    out.append(escape(text[position:]))
+    return "".join(out)
+
+
+def to_plain(message):
+    """Text of a rendered message without markup, for when Telegram rejects the HTML"""
+    return html.unescape(TAG.sub("", message))
+
+
+def split_html(rendered, size):
+    """Cut one rendered line into pieces of at most size characters
+
+    Cuts fall between tags and entities, at a space when one is near. Tags
+    open at a cut are closed at the end of the piece and reopened at the
+    start of the next, so every piece is valid on its own.
+    """
+    pieces = []
+    stack = []  # (opening tag, name) of the tags open at this point
+    current = ""
+
+    def closing():
+        return "".join(f"</{name}>" for _, name in reversed(stack))
+
+    def cut():
+        nonlocal current
+        pieces.append(current + closing())
+        current = "".join(tag for tag, _ in stack)
+
+    for match in HTML_TOKEN.finditer(rendered):
+        token = match.group(0)
+        if match.group(2):
+            if match.group(1):
+                stack.pop()
+            else:
+                if len(current) + len(token) + len(closing()) + len(match.group(2)) + 3 > size:
+                    cut()
+                stack.append((token, match.group(2)))
+            current += token
+        elif token.startswith("&"):
+            if len(current) + len(token) + len(closing()) > size:
+                cut()
+            current += token
+        else:
+            text = token
+            while text:
+                room = size - len(current) - len(closing())
+                if len(text) <= room:
+                    current += text
+                    break
+                if room <= 0:
+                    cut()
+                    continue
+                position = text.rfind(" ", 0, room + 1)
+                position = position if position > room // 2 else room
+                current += text[:position]
+                text = text[position:].lstrip(" ")
+                cut()
+    if TAG.sub("", current).strip():
+        pieces.append(current + closing())
+    return pieces
+
+
+class Messages:
+    """Accumulates rendered lines into messages no longer than limit"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.messages = []
+        self.lines = []
+        self.size = 0
+        self.wrapper = None  # (open, close) of a code block or quote
+        self.reopen = False  # the wrapper's opening tag is still owed to the current message
+
+    def open(self, opening, closing):
+        self.close()
+        self.wrapper = (opening, closing)
+        self.reopen = True
+
+    def close(self):
+        if self.wrapper and not self.reopen:
+            self.lines[-1] += self.wrapper[1]
+            self.size += len(self.wrapper[1])
+        self.wrapper = None
+        self.reopen = False
+
+    def flush(self):
+        if not self.lines:
+            return
+        message = "\n".join(self.lines)
+        if self.wrapper and not self.reopen:
+            message += self.wrapper[1]
+            self.reopen = True
+        if message.strip():
+            self.messages.append(message)
+        self.lines = []
+        self.size = 0
+
+    def add(self, rendered):
+        reserve = len(self.wrapper[1]) if self.wrapper else 0
+        opening = self.wrapper[0] if self.wrapper and self.reopen else ""
+        if self.lines and self.size + 1 + len(opening) + len(rendered) + reserve > self.limit:
+            self.flush()
+            opening = self.wrapper[0] if self.wrapper else ""
+        if not self.lines and not rendered.strip() and not self.wrapper:
+            return  # no blank lines at the top of a message
+        if len(opening) + len(rendered) + reserve > self.limit:
+            # Too long even for a message of its own
+            pieces = split_html(rendered, self.limit - len(opening) - reserve)
+            for piece in pieces[:-1]:
+                self._append(piece)
+                self.flush()
+            rendered = pieces[-1] if pieces else ""
+        self._append(rendered)
+
+    def _append(self, rendered):
+        opening = self.wrapper[0] if self.wrapper and self.reopen else ""
+        self.lines.append(opening + rendered)
+        self.size += len(opening) + len(rendered) + 1
+        self.reopen = False
+
+    def done(self):
+        self.close()
+        self.flush()
+        return self.messages
+
+
+def render_messages(text, limit=MAX_LENGTH):
+    """Telegram HTML messages for a Markdown answer, each at most limit characters"""
+    messages = Messages(limit)
+    in_code = False
+
+    for line in (text or "").split("\n"):
+        fence = FENCE.match(line)
+        if fence:
+            if in_code:
+                messages.close()
+            else:
+                language = fence.group(1)
+                opening = f'<pre><code class="language-{language}">' if language else "<pre><code>"
+                messages.open(opening, "</code></pre>")
+            in_code = not in_code
+            continue
+
+        if in_code:
+            messages.add(escape(line))
+            continue
+
+        quote = QUOTE.match(line)
+        if quote:
+            if not messages.wrapper:
+                messages.open("<blockquote>", "</blockquote>")
+            line = quote.group(1)
+        elif messages.wrapper:
+            messages.close()
+
+        heading = HEADING.match(line)
+        bullet = BULLET.match(line)
+        if heading:
+            # Already bold, so drop bold markers rather than nest <b>
+            messages.add(f"<b>{inline(heading.group(1).replace('**', ''))}</b>")
+        elif RULE.match(line):
+            messages.add("")
+        elif bullet:
+            messages.add(f"{bullet.group(1)}• {inline(bullet.group(2))}")
+        else:
+            messages.add(inline(line))
+
+    return messages.done()
+
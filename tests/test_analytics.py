@@ -0,0 +1,52 @@
+from analytics import wallet_pnl, SOL_MINT
+
+TOKEN = "Tok1111111111111111111111111111111111111111"
+
+
+def swap(timestamp, sold, bought):
+    return {'timestamp': timestamp, 'sold_tokens': sold, 'bought_tokens': bought}
+
+
+def sol(amount):
+    return {'address': SOL_MINT, 'symbol': 'SOL', 'amount': amount}
+
+
+def token(amount, price=0.01):
+    return {'address': TOKEN, 'symbol': 'TOK', 'amount': amount, 'current_price': price}
+
+
+def test_sells_beyond_bought_amount_are_not_realized():
+    # Buy 100 for 1 SOL, then sell 200 (half of them airdropped) for 4 SOL
+    pnl = wallet_pnl([
+        swap(1000, [sol(1.0)], [token(100)]),
+        swap(2000, [token(200)], [sol(4.0)]),
+    ], sol_price=100, now=3000)
+
+    assert pnl['realized_pnl_sol'] == 1.0
+    assert pnl['tokens'][0]['unmatched_sold'] == 100
+    assert pnl['closed_positions'] == 1
+    assert pnl['open_positions'] == 0
+
+
+def test_partial_sell_is_open_not_closed():
+    pnl = wallet_pnl([
+        swap(1000, [sol(1.0)], [token(100)]),
+        swap(2000, [token(40)], [sol(0.8)]),
+    ], sol_price=100, now=3000)
+
+    assert pnl['realized_pnl_sol'] == 0.4
+    assert pnl['closed_positions'] == 0
+    assert pnl['open_positions'] == 1
+    assert pnl['win_rate'] is None
+    assert 'unmatched_sold' not in pnl['tokens'][0]
+
+
+def test_full_exit_counts_towards_win_rate():
+    pnl = wallet_pnl([
+        swap(1000, [sol(1.0)], [token(100)]),
+        swap(2000, [token(100)], [sol(0.5)]),
+    ], sol_price=100, now=3000)
+
+    assert pnl['realized_pnl_sol'] == -0.5
+    assert pnl['closed_positions'] == 1
+    assert pnl['win_rate'] == 0.0
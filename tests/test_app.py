@@ -0,0 +1,17 @@
+import app
+import database
+
+
+def test_history_etag_differs_between_users(monkeypatch):
+    page = {"total": 2, "first": 0, "start": 0, "messages": [
+        {"role": "user", "texts": ["gm"], "seq": 0}, {"role": "model", "texts": ["gm!"], "seq": 1}]}
+    monkeypatch.setattr(database, "get_history", lambda user_id, limit, before: page)
+    client = app.app.test_client()
+
+    first = client.post("/api/chat/history", json={"user_id": 1})
+    assert first.status_code == 200
+    again = client.post("/api/chat/history", json={"user_id": 1}, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    other = client.post("/api/chat/history", json={"user_id": 2}, headers={"If-None-Match": first.headers["ETag"]})
+    assert other.status_code == 200
+    assert other.get_json()["user_id"] == 2
@@ -0,0 +1,22 @@
+import cache
+
+
+def test_reads_touch_accessed_at_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(cache._local, "conn", None, raising=False)
+    # No in-process tier, so every read goes to SQLite
+    store = cache.Cache("test", ttl=60, memory_entries=0)
+    store.set_many({"a": 1, "b": 2})
+    conn = cache._connect()
+
+    writes = conn.total_changes
+    for _ in range(10):
+        assert store.get_entry("a", shared=True).value == 1
+        assert store.get_many(["a", "b"]) == {"a": 1, "b": 2}
+    assert conn.total_changes == writes
+
+    conn.execute("UPDATE entries SET accessed_at = accessed_at - ?", (cache.TOUCH_INTERVAL,))
+    writes = conn.total_changes
+    store.get_entry("a", shared=True)
+    store.get_many(["a", "b"])
+    assert conn.total_changes == writes + 2  # a, then only b
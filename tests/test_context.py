@@ -0,0 +1,23 @@
+import context
+import database
+
+
+def test_repeated_message_does_not_skip_unsummarized_turns(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(database, "get_summary", lambda _id: (stored.get("summary"), 0))
+    monkeypatch.setattr(database, "set_summary", lambda _id, summary: stored.update(summary=summary))
+
+    def summarize(previous, transcript):
+        return previous + "\n" + transcript
+
+    messages = []
+    for turn in range(30):
+        # "gm" repeats, so its fingerprint alone matches several turns
+        text = "gm" if turn % 3 == 0 else f"question number {turn} about my wallet"
+        messages.append({"role": "user", "parts": [{"text": text}]})
+        window = context.build_contents("u", messages, summarize, budget=120)
+        dropped = messages[:len(messages) - len(window)]
+        summary = (stored.get("summary") or {}).get("text", "")
+        for message in dropped:
+            assert f"{message['role']}: {message['parts'][0]['text']}" in summary
+        messages.append({"role": "model", "parts": [{"text": f"answer number {turn}"}]})
@@ -0,0 +1,67 @@
+import threading
+import pytest
+import analyze_transactions
+import cache
+import prefetch
+import token_registry
+
+WALLET = "CkBWowCj1SFFVDk8Fkn9b2S3gV8kgBm9MEPG2YQvmhFB"
+MINT = "CreiuhfwdWCN5mJbMJtA9bBpYQrQF2tCBuZwSPWfpump"
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(cache._local, "conn", None, raising=False)
+    analyze_transactions.coin_cache.clear()
+    monkeypatch.setenv("HeliusApi", "key")
+
+
+def test_wallet_lookup_error_is_not_cached(monkeypatch):
+    error = {"jsonrpc": "2.0", "error": {"code": -32000, "message": "Asset Not Found"}}
+    monkeypatch.setattr(analyze_transactions.http_client, "post", lambda *args, **kwargs: Response(error))
+    assert analyze_transactions.fetch_coin_data(WALLET) is None
+    assert analyze_transactions.coin_cache.get_entry(f"solana-{WALLET}") is None
+
+
+def test_known_mint_is_not_synced_as_a_wallet(monkeypatch):
+    token_registry.registry.add(MINT, "PYTHIA", "Pythia")
+    synced = []
+    monkeypatch.setattr(prefetch, "get_coin_data", lambda address: {"symbol": "PYTHIA"} if address == MINT else None)
+    monkeypatch.setattr(prefetch, "get_transactions", lambda address, cancelled=None: synced.append(address))
+    job = prefetch.start(f"what about {MINT} and {WALLET}?")
+    for future in job.futures:
+        future.result()
+    assert synced == [WALLET]
+
+
+def test_sync_stops_when_the_lookup_finds_a_token(monkeypatch):
+    found = threading.Event()
+    stopped = []
+
+    def get_transactions(address, cancelled=None):
+        found.wait(5)
+        stopped.append(cancelled())
+
+    monkeypatch.setattr(prefetch, "get_transactions", get_transactions)
+    monkeypatch.setattr(prefetch, "get_coin_data", lambda address: found.set() or {"symbol": "NEW"})
+    job = prefetch.Prefetch([WALLET])
+    is_token = threading.Event()
+    sync = threading.Thread(target=prefetch.sync, args=(WALLET, job, is_token))
+    sync.start()
+    prefetch.lookup(WALLET, job, is_token)
+    sync.join()
+    assert stopped == [True]
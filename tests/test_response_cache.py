@@ -0,0 +1,39 @@
+import response_cache
+
+
+def request(*contents):
+    return {"contents": list(contents), "generationConfig": {"temperature": 0.2}}
+
+
+def user(text):
+    return {"role": "user", "parts": [{"text": text}]}
+
+
+def model(text):
+    return {"role": "model", "parts": [{"text": text}]}
+
+
+def tool_result(content):
+    return {"role": "function", "parts": [{"functionResponse": {"name": "get_user_trades",
+                                                                "response": {"content": content}}}]}
+
+
+def test_earlier_context_is_in_the_key():
+    first = request(user("my wallet is AAA"), model("noted"), user("what is my pnl"))
+    second = request(user("my wallet is BBB"), model("noted"), user("What is my PnL"))
+    assert response_cache.request_key(first, 1) != response_cache.request_key(second, 1)
+    yes_to_a = request(user("sell A?"), model("want the chart?"), user("yes"))
+    yes_to_b = request(user("buy B?"), model("want the news?"), user("yes"))
+    assert response_cache.request_key(yes_to_a, 1) != response_cache.request_key(yes_to_b, 1)
+
+
+def test_tool_free_opening_is_shared_between_users():
+    assert response_cache.request_key(request(user("gm")), 1) == response_cache.request_key(request(user("GM ")), 2)
+
+
+def test_tool_results_of_the_turn_are_in_the_key():
+    call = {"role": "model", "parts": [{"functionCall": {"name": "get_user_trades", "args": {}}}]}
+    old = request(user("my trades"), call, tool_result("a"))
+    new = request(user("my trades"), call, tool_result("b"))
+    assert response_cache.request_key(old, 1) != response_cache.request_key(new, 1)
+    assert response_cache.request_key(old, 1) != response_cache.request_key(old, 2)
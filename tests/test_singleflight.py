@@ -0,0 +1,34 @@
+import threading
+import singleflight
+
+
+class BusyOnceCache:
+    """Reports another worker's lock on the first call, once a waiter has joined"""
+    namespace = "test"
+
+    def __init__(self):
+        self.calls = 0
+
+    def lock(self, key, ttl):
+        self.calls += 1
+        if self.calls == 1:
+            while not singleflight.waiting(self, key):
+                pass
+            return None
+        return "token"
+
+    def unlock(self, key, token):
+        pass
+
+
+def test_waiter_does_not_inherit_a_skipped_background_refresh():
+    cache = BusyOnceCache()
+    results = {}
+    leader = threading.Thread(target=lambda: results.setdefault(
+        "leader", singleflight.do(cache, "k", lambda: "refreshed", wait=False)))
+    leader.start()
+    while ("test", "k") not in singleflight._flights:
+        pass
+    results["waiter"] = singleflight.do(cache, "k", lambda: "fetched")
+    leader.join()
+    assert results == {"leader": None, "waiter": "fetched"}
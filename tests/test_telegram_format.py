@@ -0,0 +1,39 @@
+import re
+from telegram_format import render_messages, to_plain
+
+
+def balanced(message):
+    stack = []
+    for closing, name in re.findall(r"<(/?)(\w+)[^>]*>", message):
+        if closing:
+            assert stack and stack.pop() == name
+        else:
+            stack.append(name)
+    return not stack
+
+
+def test_long_line_that_fits_is_not_broken():
+    line = " ".join(["word"] * 300)  # 1499 characters
+    messages = render_messages(line)
+    assert messages == [line]
+
+
+def test_bold_survives_a_split_inside_the_line():
+    paragraph = "**" + " ".join(["bold"] * 192) + "**"  # 964 characters
+    messages = render_messages(paragraph, limit=400)
+    assert len(messages) > 1
+    for message in messages:
+        assert len(message) <= 400
+        assert message.startswith("<b>") and message.endswith("</b>")
+        assert "**" not in message
+        assert balanced(message)
+    assert " ".join(to_plain(message) for message in messages) == " ".join(["bold"] * 192)
+
+
+def test_escaped_text_and_links_are_split_whole():
+    paragraph = " ".join(["[a & b](https://example.com/x) <tag>"] * 60)
+    messages = render_messages(paragraph, limit=300)
+    for message in messages:
+        assert len(message) <= 300
+        assert balanced(message)
+        assert re.search(r"&(?!amp;|lt;|gt;|quot;|#)", message) is None
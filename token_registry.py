@@ -0,0 +1,170 @@
+"""In-memory registry of known tokens for resolving symbols and names to mints
+
+Seeded from tokens_data.json-style metadata (CoinGecko coin documents, or
+coin caches keyed "solana-<mint>") and kept current from get_coin_data
+results. Mints, symbols and names are interned and kept in parallel lists,
+with hash indexes by mint and symbol and a sorted (key, id) array for prefix
+search, so lookups never leave the process.
+"""
+import difflib
+import json
+import os
+import sys
+import threading
+from bisect import bisect_left, insort
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SEED_FILES = [name.strip() for name in os.environ.get("TokenRegistryFiles", "tokens_data.json,coin_data_cache.json").split(",")
+              if name.strip()]
+MAX_MATCHES = 5
+
+
+def normalize(text):
+    """Lookup key for a symbol or name, e.g. '$Pythia ' -> 'pythia'"""
+    return " ".join((text or "").split()).lstrip("$").casefold()
+
+
+class TokenRegistry:
+
+    def __init__(self):
+        self.mints = []
+        self.symbols = []
+        self.names = []
+        self.by_mint = {}
+        self.by_symbol = {}  # normalized symbol -> token ids
+        self.prefixes = []  # sorted (normalized symbol or name, token id)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mints)
+
+    def add(self, mint, symbol, name=None):
+        """Insert or update a token; returns its id"""
+        if not mint or not symbol:
+            return None
+        symbol = sys.intern(symbol.upper())
+        name = sys.intern(name) if name and name != 'Unknown' else symbol
+        with self.lock:
+            token_id = self.by_mint.get(mint)
+            if token_id is not None:
+                if self.symbols[token_id] == symbol and self.names[token_id] == name:
+                    return token_id
+                self._unindex(token_id)
+                self.symbols[token_id] = symbol
+                self.names[token_id] = name
+            else:
+                token_id = len(self.mints)
+                self.mints.append(sys.intern(mint))
+                self.symbols.append(symbol)
+                self.names.append(name)
+                self.by_mint[self.mints[token_id]] = token_id
+            self._index(token_id)
+            return token_id
+
+    def _keys(self, token_id):
+        return {normalize(self.symbols[token_id]), normalize(self.names[token_id])}
+
+    def _index(self, token_id):
+        self.by_symbol.setdefault(normalize(self.symbols[token_id]), []).append(token_id)
+        for key in self._keys(token_id):
+            insort(self.prefixes, (key, token_id))
+
+    def _unindex(self, token_id):
+        ids = self.by_symbol.get(normalize(self.symbols[token_id]), [])
+        if token_id in ids:
+            ids.remove(token_id)
+        for key in self._keys(token_id):
+            position = bisect_left(self.prefixes, (key, token_id))
+            if position < len(self.prefixes) and self.prefixes[position] == (key, token_id):
+                del self.prefixes[position]
+
+    def token(self, token_id):
+        return {'address': self.mints[token_id], 'symbol': self.symbols[token_id], 'name': self.names[token_id]}
+
+    def get(self, mint):
+        """The token with this mint, or None"""
+        token_id = self.by_mint.get(mint)
+        return self.token(token_id) if token_id is not None else None
+
+    def find(self, query, limit=MAX_MATCHES):
+        """Tokens matching a mint, symbol or name, best first
+
+        An exact mint or symbol wins, then symbols and names starting with the
+        query, then close spellings of symbols and names sharing its first letter.
+        """
+        key = normalize(query)
+        if not key:
+            return []
+        with self.lock:
+            if query.strip() in self.by_mint:
+                return [self.token(self.by_mint[query.strip()])]
+            found = list(self.by_symbol.get(key, []))
+
+            position = bisect_left(self.prefixes, (key, -1))
+            while len(found) < limit and position < len(self.prefixes) and self.prefixes[position][0].startswith(key):
+                token_id = self.prefixes[position][1]
+                if token_id not in found:
+                    found.append(token_id)
+                position += 1
+
+            if not found:
+                # Typos: only compare against keys with the same first letter
+                start = bisect_left(self.prefixes, (key[0], -1))
+                end = bisect_left(self.prefixes, (chr(ord(key[0]) + 1), -1))
+                candidates = {}
+                for candidate, token_id in self.prefixes[start:end]:
+                    candidates.setdefault(candidate, token_id)
+                for match in difflib.get_close_matches(key, list(candidates), n=limit, cutoff=0.75):
+                    if candidates[match] not in found:
+                        found.append(candidates[match])
+
+            return [self.token(token_id) for token_id in found[:limit]]
+
+    def load(self, path):
+        """Add the tokens in a metadata file; returns how many were read"""
+        with open(path) as f:
+            data = json.load(f)
+        documents = data if isinstance(data, list) else [data]
+        count = 0
+        for document in documents:
+            if isinstance(document, dict) and 'platforms' in document:
+                # A CoinGecko coin document
+                mint = (document.get('platforms') or {}).get('solana')
+                count += self.add(mint, document.get('symbol'), document.get('name')) is not None
+                continue
+            # A coin cache: {"solana-<mint>": {"data": {...}}}
+            for key, entry in (document or {}).items():
+                platform, _, mint = key.partition("-")
+                coin = entry.get('data', entry) if isinstance(entry, dict) else None
+                if platform == 'solana' and coin:
+                    count += self.add(mint, coin.get('symbol'), coin.get('name')) is not None
+        return count
+
+
+registry = TokenRegistry()
+
+
+def load_seed_files():
+    for name in SEED_FILES:
+        path = name if os.path.isabs(name) else os.path.join(ROOT, name)
+        try:
+            print(f"Loaded {registry.load(path)} token(s) from {name}")
+        except (OSError, ValueError) as e:
+            print(f"Could not load tokens from {name}: {e}")
+
+
+load_seed_files()
+
+
+def remember(mint, coin_data):
+    """Record a get_coin_data result"""
+    if coin_data:
+        registry.add(mint, coin_data.get('symbol'), coin_data.get('name'))
+
+
+def find_token(query, limit=MAX_MATCHES):
+    return registry.find(query, limit)
+
+
+def get_token(mint):
+    return registry.get(mint)
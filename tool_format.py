@@ -0,0 +1,114 @@
+import os
+from datetime import datetime, timezone
+
+MAX_ROWS = int(os.environ.get("ToolMaxRows", "50"))
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+
+
+def num(value, digits=4):
+    """Shortest readable form of a number with `digits` significant digits"""
+    if value is None:
+        return "-"
+    value = float(value)
+    if value == 0:
+        return "0"
+    text = f"{value:.{digits}g}"
+    if "e" in text:
+        mantissa, exponent = text.split("e")
+        return f"{mantissa}e{int(exponent)}"
+    return text
+
+
+def minute(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def table(header, rows):
+    return "\n".join("|".join(row) for row in [header] + rows)
+
+
+class Aliases:
+    """Interns token mints to short aliases (T1, T2, ...) with a legend"""
+
+    def __init__(self):
+        self.aliases = {SOL_MINT: "SOL"}
+        self.legend = []
+
+    def __call__(self, token):
+        mint = token['address']
+        alias = self.aliases.get(mint)
+        if alias is None:
+            alias = f"T{len(self.legend) + 1}"
+            self.aliases[mint] = alias
+            self.legend.append(f"{alias}={token.get('symbol') or '?'} "
+                               f"({token.get('name') or 'Unknown Token'}) "
+                               f"price=${num(token.get('current_price'))} mint={mint}")
+        return alias
+
+
+def encode_trades(swaps, max_rows=MAX_ROWS):
+    """Header-plus-rows encoding of analyze_swap_transactions output
+
+    Mints are replaced by aliases defined once in a legend, times are UTC
+    minutes, and only the newest `max_rows` swaps are listed. Older swaps are
+    summarized as per-token net amounts.
+    """
+    if not swaps:
+        return "no swaps found for this wallet"
+
+    alias = Aliases()
+
+    def legs(tokens):
+        # Native and wrapped SOL can both show up for the same leg, list it once
+        seen = set()
+        out = []
+        for token in tokens:
+            if token['address'] in seen:
+                continue
+            seen.add(token['address'])
+            out.append(f"{num(token['amount'])} {alias(token)}")
+        return " + ".join(out) or "-"
+
+    swaps = sorted(swaps, key=lambda swap: swap['timestamp'], reverse=True)
+    shown, omitted = swaps[:max_rows], swaps[max_rows:]
+    rows = [[minute(swap['timestamp']), swap.get('source', '?'),
+             legs(swap.get('sold_tokens', [])), legs(swap.get('bought_tokens', []))]
+            for swap in shown]
+
+    lines = [f"now={minute(datetime.now(timezone.utc).timestamp())} UTC, "
+             f"{len(swaps)} swaps" + (f", newest {len(shown)} listed" if omitted else "")]
+    body = table(["time", "source", "sold", "bought"], rows)
+
+    if omitted:
+        net = {}
+        for swap in omitted:
+            for sign, tokens in ((-1, swap.get('sold_tokens', [])), (1, swap.get('bought_tokens', []))):
+                for token in {t['address']: t for t in tokens}.values():
+                    key = alias(token)
+                    net[key] = net.get(key, 0.0) + sign * token['amount']
+        summary = ", ".join(f"{key} {'+' if value >= 0 else ''}{num(value)}" for key, value in net.items())
+        body += (f"\n{len(omitted)} older swaps {minute(omitted[-1]['timestamp'])}.."
+                 f"{minute(omitted[0]['timestamp'])} not listed, net: {summary}")
+
+    return "\n".join(lines + ["tokens: " + "; ".join(alias.legend)] + [body])
+
+
+def encode_tokens(tokens):
+    """symbol|name|mint table of token_registry matches"""
+    if not tokens:
+        return "no known token matches, ask the user for the mint address"
+    return table(["symbol", "name", "mint"], [[t['symbol'], t['name'], t['address']] for t in tokens])
+
+
+def encode_price_history(history):
+    """Compact time|price table for get_historical_prices output"""
+    stats = history['stats']
+    lines = [f"token={history['token']} interval={history['interval']} points={history['points']} "
+             f"first={num(stats['first'])} last={num(stats['last'])} min={num(stats['min'])} max={num(stats['max'])} "
+             f"change={num(stats['change_pct'], 3)}% volatility={num(stats['volatility_pct'], 3)}%"]
+    if len(history['prices']) < history['points']:
+        lines.append(f"downsampled to {len(history['prices'])} points")
+    price_column = f"price_{history['currency'].lower()}"
+    lines.append(table(["time", price_column],
+                       [[minute(ts), num(price)] for ts, price in zip(history['timestamps'], history['prices'])]))
+    return "\n".join(lines)
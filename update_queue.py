@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+import metrics
+
+WORKERS = int(os.environ.get("UpdateWorkers", "4"))
+QUEUE_SIZE = int(os.environ.get("UpdateQueueSize", "100"))  # per worker
+SEEN_UPDATES = 10000  # update_ids remembered for de-duplication
+TYPING_INTERVAL = 4  # Telegram shows "typing" for about 5 seconds
+
+
+class UpdateQueue:
+    """Bounded queue of Telegram updates drained by a pool of worker threads
+
+    Updates are de-duplicated by update_id and sharded by chat id, so each
+    chat's messages are handled in order by the same worker while different
+    chats run in parallel. Workers start lazily in the process that first
+    submits, which keeps the pool fork-safe under gunicorn.
+    """
+
+    def __init__(self, handler, send_typing=None, workers=WORKERS, maxsize=QUEUE_SIZE):
+        self.handler = handler
+        self.send_typing = send_typing
+        self.workers = workers
+        self.maxsize = maxsize
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._queues = None
+        self._pid = None
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queues = [queue.Queue(maxsize=self.maxsize) for _ in range(self.workers)]
+            for shard in self._queues:
+                threading.Thread(target=self._work, args=(shard,), daemon=True).start()
+            self._seen.clear()
+            self._pid = os.getpid()
+
+    @staticmethod
+    def chat_id(update):
+        message = update.message or update.edited_message
+        return message.chat.id if message else None
+
+    def submit(self, update):
+        """Queue an update; returns False when the queue is full"""
+        self._ensure_workers()
+        with self._lock:
+            if update.update_id in self._seen:
+                print(f"Skipping duplicate update {update.update_id}")
+                return True
+            self._seen[update.update_id] = None
+            while len(self._seen) > SEEN_UPDATES:
+                self._seen.popitem(last=False)
+
+        chat_id = self.chat_id(update)
+        key = chat_id if chat_id is not None else update.update_id
+        shard = self._queues[zlib.crc32(str(key).encode()) % self.workers]
+        try:
+            shard.put_nowait(update)
+        except queue.Full:
+            with self._lock:
+                # Let Telegram's retry of this update through later
+                self._seen.pop(update.update_id, None)
+            print(f"Update queue full, rejecting update {update.update_id}")
+            return False
+        return True
+
+    def _typing(self, chat_id, done):
+        while not done.is_set():
+            try:
+                self.send_typing(chat_id)
+            except Exception as e:
+                print(f"typing indicator failed: {e}")
+            done.wait(TYPING_INTERVAL)
+
+    def _work(self, shard):
+        while True:
+            update = shard.get()
+            metrics.new_request_id(f"tg-{update.update_id}")
+            done = threading.Event()
+            chat_id = self.chat_id(update)
+            if self.send_typing and chat_id is not None:
+                threading.Thread(target=self._typing, args=(chat_id, done), daemon=True).start()
+            try:
+                self.handler(update)
+            except Exception as e:
+                print(f"Error processing Telegram update {update.update_id}: {e}")
+            finally:
+                done.set()
+                shard.task_done()
@@ -0,0 +1,89 @@
+"""Analysis of many wallets at once, results yielded as each one finishes
+
+Wallets are synced and analyzed on a shared per-process pool, with at most
+`concurrency` of one batch in flight, so a batch of hundreds of wallets holds
+as many threads and connections as a batch of ten. Outbound calls go through
+http_client's per-host rate limits, token metadata is looked up once for
+mints shared between wallets (see get_coin_data_batch), and the SOL price is
+fetched once per batch.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+import clients
+import metrics
+import prefetch
+from analytics import columns_pnl, SOL_MINT
+from analyze_transactions import get_coin_data, get_swap_store, priced_columns, SyncCancelled
+
+WORKERS = int(os.environ.get("BatchWorkers", "8"))
+MAX_WALLETS = int(os.environ.get("BatchMaxWallets", "500"))
+
+WALLETS = metrics.counter("wallet_batch_wallets_total", "Wallets analyzed through the batch API", ["result"])
+
+def analyze_wallet(wallet_address, sol_price=None, cancelled=None):
+    """One result row: the wallet's PnL summary, or the error that stopped it"""
+    started = time.perf_counter()
+    row = {'wallet': wallet_address}
+    try:
+        store = get_swap_store(wallet_address, cancelled=cancelled)
+        row['status'] = 'ok'
+        row['pnl'] = columns_pnl(priced_columns(store), store.swap_count, sol_price=sol_price)
+    except SyncCancelled:
+        row['status'] = 'cancelled'
+    except Exception as e:
+        print(f"Batch analysis of {wallet_address} failed: {e}")
+        row['status'] = 'error'
+        row['error'] = str(e)
+    row['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    WALLETS.inc(result=row['status'])
+    return row
+
+
+def analyze_wallets(wallets, concurrency=WORKERS):
+    """Yield one result row per wallet, in completion order
+
+    Invalid addresses get an `invalid` row straight away. Closing the
+    generator early cancels wallets not started yet and stops running syncs
+    nobody else is waiting on.
+    """
+    concurrency = max(1, min(concurrency or WORKERS, WORKERS))
+    wallets = list(dict.fromkeys(wallets))
+    stop = threading.Event()
+    valid = []
+    for wallet in wallets:
+        if prefetch.is_solana_address(wallet):
+            valid.append(wallet)
+        else:
+            WALLETS.inc(result='invalid')
+            yield {'wallet': wallet, 'status': 'invalid', 'error': 'not a Solana address'}
+    if not valid:
+        return
+
+    sol = get_coin_data(SOL_MINT)
+    sol_price = sol['current_price'] if sol else None
+    queue = iter(valid)
+    running = set()
+
+    def submit_next():
+        wallet = next(queue, None)
+        if wallet is not None:
+            # Each task gets its own copy so spans keep the request ID
+            context = contextvars.copy_context()
+            running.add(clients.pool("wallet-batch", WORKERS).submit(context.run, analyze_wallet, wallet, sol_price, stop.is_set))
+
+    try:
+        for _ in range(concurrency):
+            submit_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.discard(future)
+                submit_next()
+                yield future.result()
+    finally:
+        stop.set()
+        for future in running:
+            future.cancel()